@@ -0,0 +1,71 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Circuit breaker keyed by device or endpoint.  After maxFailures consecutive failures a key is opened
+# (calls refused) for a backoff delay, then half-opened to let a single probe through.  A successful
+# probe closes it again; a failed one re-opens it with the delay doubled, up to maxDelay.
+
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class _Circuit(object):
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.delay = 0
+        self.retryAt = 0
+
+
+class CircuitBreaker(object):
+    def __init__(self, maxFailures, baseDelay=30, maxDelay=3600):
+        # maxFailures of zero disables tripping; failures are still counted.
+        self.maxFailures = int(maxFailures)
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        # True if a call for 'key' may go ahead now.  An open circuit whose delay has passed lets
+        # exactly one probe through.
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None or circuit.state == CLOSED:
+                return True
+            if circuit.state == OPEN and time.time() >= circuit.retryAt:
+                circuit.state = HALF_OPEN
+                return True
+            return False
+
+    def success(self, key):
+        with self._lock:
+            self._circuits.pop(key, None)
+
+    def failure(self, key):
+        # Record a failed call.  Returns the backoff delay if this failure opened the circuit.
+        with self._lock:
+            circuit = self._circuits.setdefault(key, _Circuit())
+            circuit.failures = circuit.failures + 1
+            if circuit.state == HALF_OPEN:
+                circuit.delay = min(circuit.delay * 2, self.maxDelay)
+            elif circuit.state == CLOSED and self.maxFailures != 0 and circuit.failures >= self.maxFailures:
+                circuit.delay = self.baseDelay
+            else:
+                return None
+            circuit.state = OPEN
+            circuit.retryAt = time.time() + circuit.delay
+            return circuit.delay
+
+    def state(self, key):
+        with self._lock:
+            circuit = self._circuits.get(key)
+            return CLOSED if circuit is None else circuit.state
+
+    def openKeys(self):
+        with self._lock:
+            return [key for (key, circuit) in self._circuits.items() if circuit.state != CLOSED]
@@ -0,0 +1,73 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Asynchronous device commands.  Each device/target pair (e.g. a floodlight's "light") holds only the
+# latest desired value: a command still waiting to be sent is simply overwritten by a newer one, so
+# rapid on/off toggles collapse into a single request.  Commands for one device go out in order;
+# different devices are served concurrently.
+
+import threading
+import time
+
+from WorkerPool import WorkerPool
+
+# After a command is sent, the API can take a few seconds to report the new state; polls inside this
+# window must not overwrite the optimistic state.
+SETTLE_TIME = 10
+
+
+class CommandQueue(object):
+    def __init__(self, send, sent, size=2):
+        # send(deviceId, target, value) returns True on success; sent(deviceId, target, value, ok) is
+        # called after every attempt.
+        self.send = send
+        self.sent = sent
+        self._desired = {}     # (deviceId, target) -> value waiting to be sent
+        self._settling = {}    # (deviceId, target) -> time until which polls should leave it alone
+        self._lock = threading.Lock()
+        self._pool = WorkerPool(size, name="RingCommands")
+
+    def start(self):
+        self._pool.start()
+
+    def stop(self):
+        self._pool.stop()
+
+    def resize(self, size):
+        # Caps how many devices are sent commands at the same time.
+        self._pool.resize(size)
+
+    def submit(self, deviceId, target, value):
+        key = (deviceId, target)
+        with self._lock:
+            queued = key in self._desired
+            self._desired[key] = value
+        if not queued:
+            self._pool.submit(deviceId, self._send, key)
+
+    def pending(self, deviceId, target):
+        # True while a command is queued, in flight or settling; reported state is not to be trusted yet.
+        key = (deviceId, target)
+        with self._lock:
+            return key in self._desired or self._settling.get(key, 0) > time.time()
+
+    def queued(self, deviceId, target):
+        # True while a command is waiting to be sent (not counting one in flight or settling).
+        with self._lock:
+            return (deviceId, target) in self._desired
+
+    def _send(self, key):
+        with self._lock:
+            value = self._desired.pop(key)
+            self._settling[key] = float("inf")
+        try:
+            ok = self.send(key[0], key[1], value)
+        except Exception:
+            ok = False
+        with self._lock:
+            # A failed command is not waited on: the next poll puts the real state back straight away.
+            if ok:
+                self._settling[key] = time.time() + SETTLE_TIME
+            else:
+                self._settling.pop(key, None)
+        self.sent(key[0], key[1], value, ok)
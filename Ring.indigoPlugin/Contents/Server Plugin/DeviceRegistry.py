@@ -0,0 +1,38 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Index of the running Indigo devices by the Ring device (doorbot) id they represent, kept up to date
+# from deviceStartComm/deviceStopComm so lookups never have to walk the Indigo device list.
+
+import threading
+
+
+class DeviceRegistry(object):
+    def __init__(self):
+        self._byRingId = {}    # ringId -> set of Indigo device ids
+        self._ringIds = {}     # Indigo device id -> ringId
+        self._lock = threading.Lock()
+
+    def add(self, ringId, deviceId):
+        ringId = int(ringId)
+        with self._lock:
+            self._remove(deviceId)
+            self._ringIds[deviceId] = ringId
+            self._byRingId.setdefault(ringId, set()).add(deviceId)
+
+    def remove(self, deviceId):
+        with self._lock:
+            self._remove(deviceId)
+
+    def devices(self, ringId):
+        # Indigo device ids registered for a Ring device id; empty if there are none.
+        with self._lock:
+            return list(self._byRingId.get(int(ringId), ()))
+
+    def _remove(self, deviceId):
+        ringId = self._ringIds.pop(deviceId, None)
+        if ringId is not None:
+            deviceIds = self._byRingId[ringId]
+            deviceIds.discard(deviceId)
+            if len(deviceIds) == 0:
+                del self._byRingId[ringId]
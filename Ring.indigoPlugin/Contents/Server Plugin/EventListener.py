@@ -0,0 +1,140 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Local HTTP listener for pushed ding/motion notifications, so events reach Indigo without waiting
+# for the next dings/active poll.
+#
+# Notifications are POSTed as JSON to any path, e.g.
+#   {"doorbot_id": 1234, "kind": "ding", "id": 6512345678, "now": 1514764800.5, "expires_in": 180}
+# Only doorbot_id and kind are required.  When a token is configured it must be sent in the
+# X-Ring-Token header.  A 503 reply means the event could not be applied yet; send it again after
+# the Retry-After delay.
+#
+# Running this file directly sends a fake notification to a listener, for testing:
+#   python EventListener.py <port> <doorbot_id> [ding|motion] [token]
+
+import BaseHTTPServer
+import SocketServer
+import sys
+import threading
+import time
+import urllib2
+from datetime import datetime
+
+# Need json support; Use "simplejson" for Indigo support
+try:
+    import simplejson as json
+except:
+    import json
+
+EVENT_KINDS = ("ding", "motion")
+
+# Seconds a sender is asked to wait before resending an event that could not be applied.
+RETRY_AFTER = 5
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_POST(self):
+        listener = self.server.listener
+        if listener.token and self.headers.get("X-Ring-Token") != listener.token:
+            self._reply(403, "Invalid token")
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            notification = json.loads(self.rfile.read(length))
+            doorbotId = int(notification["doorbot_id"])
+            kind = notification["kind"]
+            if kind not in EVENT_KINDS:
+                raise ValueError("Unknown event kind: %s" % kind)
+        except Exception as err:
+            self._reply(400, "Invalid notification: %s" % err)
+            return
+
+        accepted = listener.callback(doorbotId, kind, notification)
+        if accepted is None:
+            self._reply(503, "Event not applied; try again", RETRY_AFTER)
+        elif accepted:
+            self._reply(202, "Accepted")
+        else:
+            self._reply(404, "No device for doorbot %s" % doorbotId)
+
+    def _reply(self, code, message, retryAfter=None):
+        self.send_response(code)
+        self.send_header("Content-Type", "text/plain")
+        if retryAfter is not None:
+            self.send_header("Retry-After", str(retryAfter))
+        self.end_headers()
+        self.wfile.write(message)
+
+    def log_message(self, format, *args):
+        self.server.listener.log(format % args)
+
+
+class EventListener(object):
+    def __init__(self, port, callback, address="127.0.0.1", token=None, log=None):
+        # callback(doorbotId, kind, notification) returns True if a device accepted the event, False if
+        # none has this doorbot, or None if the event should be sent again later.
+        self.port = int(port)
+        self.address = address
+        self.callback = callback
+        self.token = token or None
+        self.log = log or (lambda message: None)
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        self._server = _Server((self.address, self.port), _Handler)
+        self._server.listener = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name="RingEventListener")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def running(self):
+        return self._server is not None
+
+
+def eventTime(notification):
+    # Local event time from a notification's epoch 'now', defaulting to the time it arrived.
+    try:
+        return datetime.fromtimestamp(round(float(notification["now"])))
+    except:
+        return datetime.fromtimestamp(round(time.time()))
+
+
+def sendTestEvent(port, doorbotId, kind="ding", token=None, address="127.0.0.1"):
+    # Fake notifier: POST a notification the way a push bridge would.  Returns the HTTP status.
+    notification = {
+        "doorbot_id": int(doorbotId),
+        "kind": kind,
+        "id": int(time.time() * 1000),
+        "now": time.time(),
+        "expires_in": 180,
+    }
+    request = urllib2.Request("http://%s:%s/event" % (address, port), json.dumps(notification))
+    request.add_header("Content-Type", "application/json")
+    if token:
+        request.add_header("X-Ring-Token", token)
+    try:
+        return urllib2.urlopen(request).getcode()
+    except urllib2.HTTPError as err:
+        return err.code
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        sys.exit("usage: python EventListener.py <port> <doorbot_id> [ding|motion] [token]")
+    status = sendTestEvent(sys.argv[1], sys.argv[2],
+                           sys.argv[3] if len(sys.argv) > 3 else "ding",
+                           sys.argv[4] if len(sys.argv) > 4 else None)
+    sys.stdout.write("%s\n" % status)
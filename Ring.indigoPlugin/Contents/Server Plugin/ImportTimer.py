@@ -0,0 +1,60 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Measures module import times, in the spirit of python3's "-X importtime" (which Python 2 lacks).
+# While active, every import that loads a new module is recorded with its own and cumulative time,
+# nested under the import that triggered it.
+#
+# Running this file directly times one module from a cold interpreter, for comparing releases:
+#   python ImportTimer.py <module>
+
+import __builtin__
+import sys
+import time
+
+
+class ImportTimer(object):
+    def __init__(self):
+        self.records = []   # (depth, module, selfSeconds, cumulativeSeconds), children before parents
+        self._stack = [0.0]
+        self._original = None
+
+    def __enter__(self):
+        self._original = __builtin__.__import__
+        __builtin__.__import__ = self._import
+        return self
+
+    def __exit__(self, *exc_info):
+        __builtin__.__import__ = self._original
+        return False
+
+    def _import(self, name, *args, **kwargs):
+        loaded = name not in sys.modules and len(sys.modules)
+        self._stack.append(0.0)
+        start = time.time()
+        try:
+            return self._original(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            children = self._stack.pop()
+            self._stack[-1] = self._stack[-1] + elapsed
+            # Imports answered from sys.modules cost next to nothing; only record real loads.
+            if loaded is not False and len(sys.modules) != loaded:
+                self.records.append((len(self._stack) - 1, name, elapsed - children, elapsed))
+
+    def total(self):
+        return sum(cumulative for (depth, name, own, cumulative) in self.records if depth == 0)
+
+    def report(self):
+        lines = ["import time: self [us] | cumulative | imported package"]
+        for (depth, name, own, cumulative) in self.records:
+            lines.append("import time: %9i | %10i | %s%s" % (own * 1000000, cumulative * 1000000, "  " * depth, name))
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("usage: python ImportTimer.py <module>")
+    with ImportTimer() as timer:
+        __import__(sys.argv[1])
+    sys.stderr.write(timer.report() + "\n")
@@ -0,0 +1,42 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Stand-in for a heavy module that is imported at load time but not needed until later (the compiled
+# Ring client imports uuid at module level but only uses it to log in).  With a LazyModule installed
+# first, the import is answered from sys.modules and the real module is only loaded the first time
+# one of its attributes is used.
+
+import importlib
+import sys
+import threading
+import types
+
+_lock = threading.RLock()
+
+
+class LazyModule(types.ModuleType):
+    def __getattr__(self, attr):
+        # Only called for attributes this module does not have yet, i.e. before the first load.
+        with _lock:
+            module = sys.modules.get(self.__name__)
+            if module is self:
+                del sys.modules[self.__name__]
+                try:
+                    module = importlib.import_module(self.__name__)
+                except:
+                    sys.modules[self.__name__] = self
+                    raise
+            self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def lazyImport(*names):
+    # Install stand-ins for the named modules, unless they have been imported already.
+    for name in names:
+        if name not in sys.modules:
+            sys.modules[name] = LazyModule(name)
+
+
+def loaded(name):
+    # True once the real module is in sys.modules.
+    return name in sys.modules and not isinstance(sys.modules[name], LazyModule)
@@ -0,0 +1,90 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Deadline scheduler for device polling.  Every device carries its own interval between a floor and
+# a ceiling: activity snaps it back to the floor, quiet polls stretch it towards the ceiling.
+
+import heapq
+import threading
+import time
+
+# Growth factor applied to a device's interval after each quiet poll.
+BACKOFF_FACTOR = 1.5
+
+
+class PollScheduler(object):
+    def __init__(self):
+        self._queue = []       # heap of (deadline, deviceId); stale entries are skipped lazily
+        self._deadlines = {}   # deviceId -> current deadline
+        self._intervals = {}   # deviceId -> current interval in seconds
+        self._limits = {}      # deviceId -> (floor, ceiling)
+        self._lock = threading.Lock()
+
+    def add(self, deviceId, floor, ceiling, when=None):
+        # Start (or restart) polling a device, first poll at 'when' (default: now).
+        with self._lock:
+            self._limits[deviceId] = (floor, ceiling)
+            self._intervals[deviceId] = floor
+            self._push(deviceId, time.time() if when is None else when)
+
+    def remove(self, deviceId):
+        with self._lock:
+            self._deadlines.pop(deviceId, None)
+            self._intervals.pop(deviceId, None)
+            self._limits.pop(deviceId, None)
+
+    def setLimits(self, deviceId, floor, ceiling):
+        with self._lock:
+            if deviceId not in self._limits:
+                return
+            self._limits[deviceId] = (floor, ceiling)
+            self._intervals[deviceId] = min(max(self._intervals[deviceId], floor), ceiling)
+
+    def wake(self, deviceId):
+        # Poll a device as soon as possible, e.g. after an out-of-band event.
+        with self._lock:
+            if deviceId not in self._limits:
+                return
+            self._intervals[deviceId] = self._limits[deviceId][0]
+            self._push(deviceId, time.time())
+
+    def due(self, horizon=None):
+        # Pop every device whose deadline is at or before 'horizon' (default: now).
+        horizon = time.time() if horizon is None else horizon
+        result = []
+        with self._lock:
+            while len(self._queue) > 0 and self._queue[0][0] <= horizon:
+                deadline, deviceId = heapq.heappop(self._queue)
+                if self._deadlines.get(deviceId) != deadline:
+                    continue
+                del self._deadlines[deviceId]
+                result.append(deviceId)
+        return result
+
+    def reschedule(self, deviceId, active):
+        # Queue the next poll for a device that was just polled.
+        with self._lock:
+            if deviceId not in self._limits:
+                return
+            floor, ceiling = self._limits[deviceId]
+            if active:
+                interval = floor
+            else:
+                interval = min(self._intervals[deviceId] * BACKOFF_FACTOR, ceiling)
+            self._intervals[deviceId] = interval
+            self._push(deviceId, time.time() + interval)
+
+    def interval(self, deviceId):
+        return self._intervals.get(deviceId)
+
+    def secondsUntilNext(self):
+        with self._lock:
+            while len(self._queue) > 0 and self._deadlines.get(self._queue[0][1]) != self._queue[0][0]:
+                heapq.heappop(self._queue)
+            if len(self._queue) == 0:
+                return None
+            return max(self._queue[0][0] - time.time(), 0.0)
+
+    def _push(self, deviceId, deadline):
+        self._deadlines[deviceId] = deadline
+        heapq.heappush(self._queue, (deadline, deviceId))
@@ -0,0 +1,83 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Token-bucket rate limiter for the Ring API, shared by every endpoint.  Callers over the limit are
+# told how long until a token is free; the RequestDispatcher does the waiting.  A 429 response
+# halves the rate and pauses the bucket for the server's Retry-After (at most MAX_PAUSE); each
+# successful request then raises the rate a little until it is back at the configured maximum.
+
+import threading
+import time
+from email.utils import mktime_tz, parsedate_tz
+
+DEFAULT_RATE = 5.0      # requests per second
+DEFAULT_BURST = 10
+MIN_RATE = 0.2
+RATE_STEP = 0.05        # added to the rate after every successful request while recovering
+MAX_PAUSE = 60.0        # longest pause honoured from a Retry-After, in seconds
+
+
+def retryAfter(value):
+    # Seconds to wait from a Retry-After header, which holds either seconds or an HTTP date.
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        parsed = parsedate_tz(value)
+        if parsed is None:
+            return None
+        return max(mktime_tz(parsed) - time.time(), 0)
+
+
+class RateLimiter(object):
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        self._lock = threading.Lock()
+        self.throttles = 0
+        self._pausedUntil = 0
+        self.maxRate = None
+        self.configure(rate, burst)
+        self._tokens = self.burst
+        self._updated = time.time()
+
+    def configure(self, rate, burst=DEFAULT_BURST):
+        # A backoff in progress is kept unless the limit itself changed.
+        with self._lock:
+            maxRate = max(float(rate), MIN_RATE)
+            if maxRate != self.maxRate:
+                self.maxRate = maxRate
+                self.rate = maxRate
+            self.burst = max(float(burst), 1)
+
+    def tryAcquire(self):
+        # Take a token if there is one and return 0; otherwise return the seconds until there will be.
+        with self._lock:
+            now = time.time()
+            self._refill(now)
+            if now < self._pausedUntil:
+                return self._pausedUntil - now
+            if self._tokens >= 1:
+                self._tokens = self._tokens - 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def succeeded(self):
+        with self._lock:
+            if self.rate < self.maxRate:
+                self.rate = min(self.rate + RATE_STEP, self.maxRate)
+
+    def throttled(self, delay=None):
+        # The API answered 429.  Returns how long the bucket is paused for.
+        with self._lock:
+            self.throttles = self.throttles + 1
+            self.rate = max(self.rate / 2, MIN_RATE)
+            if delay is None:
+                delay = 1 / self.rate
+            delay = min(delay, MAX_PAUSE)
+            self._pausedUntil = max(self._pausedUntil, time.time() + delay)
+            self._tokens = 0
+            return delay
+
+    def _refill(self, now):
+        self._tokens = min(self._tokens + (now - self._updated) * self.rate, self.burst)
+        self._updated = now
@@ -0,0 +1,99 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Resolves recording URLs on a background thread so ding state can be published without waiting for
+# the recording redirect.  Resolved URLs are cached by event id until the signed URL expires.
+
+import Queue
+import calendar
+import threading
+import time
+import urlparse
+
+# Lifetime assumed for a resolved URL when it carries no expiry of its own.
+DEFAULT_TTL = 3600
+
+# Drop cached URLs this many seconds before their signature actually expires.
+EXPIRY_MARGIN = 60
+
+
+def urlLifetime(url, now=None):
+    # Seconds until a signed recording URL expires, from its X-Amz-Expires/X-Amz-Date or Expires parameters.
+    now = time.time() if now is None else now
+    try:
+        query = urlparse.parse_qs(urlparse.urlparse(url).query)
+        if "X-Amz-Expires" in query and "X-Amz-Date" in query:
+            signed = calendar.timegm(time.strptime(query["X-Amz-Date"][0], "%Y%m%dT%H%M%SZ"))
+            return signed + int(query["X-Amz-Expires"][0]) - now
+        if "Expires" in query:
+            return int(query["Expires"][0]) - now
+    except:
+        pass
+    return DEFAULT_TTL
+
+
+class RecordingResolver(object):
+    def __init__(self, resolve, publish, log=None):
+        # resolve(recordingId) returns the recording URL; publish(deviceId, recordingId, url) receives it.
+        self.resolve = resolve
+        self.publish = publish
+        self.log = log or (lambda message: None)
+        self._cache = {}        # recordingId -> (url, expiresAt)
+        self._pending = set()   # (deviceId, recordingId) queued or being resolved
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._work, name="RingRecordings")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self._queue.put(None)
+
+    def request(self, deviceId, recordingId):
+        # Returns the cached URL straight away if there is one; otherwise queues the lookup and returns
+        # None, and the URL is handed to publish() once resolved.
+        with self._lock:
+            url = self._cached(recordingId)
+            if url is not None:
+                return url
+            if (deviceId, recordingId) in self._pending:
+                return None
+            self._pending.add((deviceId, recordingId))
+        self._queue.put((deviceId, recordingId))
+        return None
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            (deviceId, recordingId) = item
+            try:
+                with self._lock:
+                    url = self._cached(recordingId)
+                if url is None:
+                    url = self.resolve(recordingId)
+                    with self._lock:
+                        self._expire()
+                        self._cache[recordingId] = (url, time.time() + max(urlLifetime(url) - EXPIRY_MARGIN, 0))
+                self.publish(deviceId, recordingId, url)
+            except Exception as err:
+                self.log(u"Failed to resolve recording %s: %s" % (recordingId, err))
+            finally:
+                with self._lock:
+                    self._pending.discard(item)
+
+    def _cached(self, recordingId):
+        cached = self._cache.get(recordingId)
+        if cached is not None and cached[1] > time.time():
+            return cached[0]
+        return None
+
+    def _expire(self):
+        now = time.time()
+        for recordingId in [k for (k, v) in self._cache.items() if v[1] <= now]:
+            del self._cache[recordingId]
@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Shares GET results between callers that ask for the same thing at about the same time.  Identical
+# requests already in flight are joined instead of repeated, and decoded results are reused for a
+# short TTL.  Hit, miss and join counts are kept for the statistics menu item.
+
+import threading
+import time
+
+DEFAULT_TTL = 1.5
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class RequestCoalescer(object):
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.joined = 0
+        self._results = {}     # key -> (value, expiresAt)
+        self._flights = {}     # key -> _Flight of the request in progress
+        self._lock = threading.Lock()
+
+    def get(self, key, fetch, *args):
+        # fetch(*args) for 'key', unless a fresh result is cached or the same fetch is already running.
+        # A None result (failed request) is handed to the callers waiting on it but never cached.
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None and cached[1] > time.time():
+                self.hits = self.hits + 1
+                return cached[0]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                self.misses = self.misses + 1
+                flight = self._flights[key] = _Flight()
+            else:
+                self.joined = self.joined + 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = fetch(*args)
+        except Exception as err:
+            flight.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                self._expire()
+                if flight.error is None and flight.value is not None and self.ttl > 0:
+                    self._results[key] = (flight.value, time.time() + self.ttl)
+            flight.done.set()
+        return flight.value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._results.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'joined': self.joined, 'cached': len(self._results)}
+
+    def _expire(self):
+        now = time.time()
+        for key in [k for (k, v) in self._results.items() if v[1] <= now]:
+            del self._results[key]
@@ -0,0 +1,78 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Admits Ring requests by priority lane.  When the transport is at its limit (requests in flight, or
+# the rate limiter out of tokens) waiting requests are released most urgent lane first, so a user's
+# command never queues behind background polling.  A waiting request is promoted one lane for every
+# AGING seconds it has waited, so the lower lanes are never starved.
+
+import threading
+import time
+
+# Lanes, most urgent first.
+COMMAND = 0     # user commands and logins
+ACTIVE = 1      # dings/active
+HISTORY = 2     # event history and recordings
+METADATA = 3    # ring_devices, profile and everything else
+
+AGING = 2.0
+
+# Longest a waiting request sleeps before looking at the line again.
+MAX_WAIT = 0.5
+
+
+class RequestDispatcher(object):
+    def __init__(self, limiter, maxInFlight):
+        self.limiter = limiter
+        self.maxInFlight = max(int(maxInFlight), 1)
+        self.served = [0, 0, 0, 0]
+        self.deferred = 0
+        self._inFlight = 0
+        self._waiting = []     # (lane, seq, enqueuedAt)
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, lane, timeout=None):
+        # Block until this request may be sent and return True; pair every such acquire with a release.
+        # Returns False, without a slot, if it could not be sent within 'timeout' seconds.
+        with self._cond:
+            self._seq = self._seq + 1
+            ticket = (lane, self._seq, time.time())
+            self._waiting.append(ticket)
+            waited = False
+            while True:
+                delay = MAX_WAIT
+                if timeout is not None:
+                    remaining = ticket[2] + timeout - time.time()
+                    if remaining <= 0:
+                        self._waiting.remove(ticket)
+                        self._cond.notify_all()
+                        return False
+                    delay = min(delay, remaining)
+                if self._inFlight < self.maxInFlight and self._next() is ticket:
+                    delay = self.limiter.tryAcquire()
+                    if delay == 0:
+                        self._waiting.remove(ticket)
+                        self._inFlight = self._inFlight + 1
+                        self.served[lane] = self.served[lane] + 1
+                        if waited:
+                            self.deferred = self.deferred + 1
+                        self._cond.notify_all()
+                        return True
+                waited = True
+                self._cond.wait(min(delay, MAX_WAIT))
+
+    def release(self):
+        with self._cond:
+            self._inFlight = self._inFlight - 1
+            self._cond.notify_all()
+
+    def resize(self, maxInFlight):
+        with self._cond:
+            self.maxInFlight = max(int(maxInFlight), 1)
+            self._cond.notify_all()
+
+    def _next(self):
+        # The waiting request to serve next: lowest lane after aging, oldest first within a lane.
+        now = time.time()
+        return min(self._waiting, key=lambda t: (t[0] - (now - t[2]) / AGING, t[1]))
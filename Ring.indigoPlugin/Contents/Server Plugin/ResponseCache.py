@@ -0,0 +1,65 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Cache of decoded API responses with their ETag/Last-Modified validators, so repeat requests can be
+# sent conditionally and a 304 answered from the cache.  Responses that carry no validators are
+# instead reused as-is for a fixed TTL.
+
+import threading
+import time
+
+
+class _Entry(object):
+    def __init__(self, value, etag, lastModified):
+        self.value = value
+        self.etag = etag
+        self.lastModified = lastModified
+        self.fetchedAt = time.time()
+
+
+class ResponseCache(object):
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def fresh(self, key, ttl):
+        # The cached value if it has no validators and is younger than ttl seconds, otherwise None.
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.etag or entry.lastModified:
+                return None
+            if time.time() - entry.fetchedAt < ttl:
+                return entry.value
+            return None
+
+    def conditionalHeaders(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            headers = {}
+            if entry is not None:
+                if entry.etag:
+                    headers['If-None-Match'] = entry.etag
+                if entry.lastModified:
+                    headers['If-Modified-Since'] = entry.lastModified
+            return headers
+
+    def notModified(self, key):
+        # The server answered 304: the cached value is current again.
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry.fetchedAt = time.time()
+            return entry.value
+
+    def store(self, key, responseHeaders, value):
+        with self._lock:
+            self._entries[key] = _Entry(value, responseHeaders.get('ETag'), responseHeaders.get('Last-Modified'))
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,420 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Extensions to the Ring client: calls the plugin needs that Ring itself does not provide, and every
+# Ring request routed through one pooled keep-alive RingTransport.
+
+import os
+import threading
+import time
+import uuid
+
+import indigo
+import requests
+from Ring import Ring, AUTH_REFRESH_TIMEOUT
+from ResponseCache import ResponseCache
+from RequestCoalescer import RequestCoalescer
+from RequestDispatcher import ACTIVE, COMMAND, HISTORY, METADATA
+from RingModels import ActiveDing, DeviceMetadata, DeviceState, HistoryEvent
+from RingTransport import RingTransport
+
+# Need json support; Use "simplejson" for Indigo support
+try:
+    import simplejson as json
+except:
+    import json
+
+# doorbots/history returns the newest rows across every doorbot in the request, so ask for a few
+# rows per device to give each one a fair chance of appearing in a single batched response.
+HISTORY_ROWS_PER_DEVICE = 3
+HISTORY_MAX_ROWS = 100
+
+# Renew the session this long before AUTH_REFRESH_TIMEOUT runs out, and retry a failed renewal after
+# AUTH_RETRY_DELAY seconds.
+AUTH_REFRESH_MARGIN = 3600
+AUTH_RETRY_DELAY = 300
+
+# How long ring_devices and profile responses are reused when the API sends no ETag or Last-Modified
+# to revalidate them with.  Live states (battery, light) are only reused for STATES_TTL so they stay
+# as fresh as the fastest poll; the longer DEVICES_TTL applies to metadata refreshes.
+STATES_TTL = 1.5
+DEVICES_TTL = 30
+PROFILE_TTL = 3600
+
+# Device metadata (names, models, firmware, subscription) hardly ever changes; it is taken from
+# ring_devices at most this often, or when a rescan asks for it.
+METADATA_TTL = 4 * 3600
+
+RECORDING_USER_AGENT = 'AppleCoreMedia/1.0.0.14C92 (iPhone; U; CPU OS 10_2 like Mac OS X; en_us)'
+
+
+class RingClient(Ring):
+    def __init__(self, plugin):
+        self.transport = RingTransport(log=plugin.errorLog)
+        self.responses = ResponseCache()
+        self.shared = RequestCoalescer()
+        self.metadata = {}
+        self._metadataAt = 0
+        Ring.__init__(self, plugin)
+        self._authLock = threading.Lock()
+        self._authGeneration = 0
+        self._authForced = False
+        self._refresher = None
+        self._refresherStop = threading.Event()
+
+    def startup(self, force):
+        # Open the first connection to the API while the rest of startup gets going.
+        self.transport.warmUp(self.baseUrl)
+        return Ring.startup(self, force)
+
+    def refreshAuth(self, force):
+        # Single-flight: only one login is ever in progress.  Callers arriving while it runs wait for it
+        # and share its outcome instead of starting a login of their own.  A forced refresh only shares
+        # the outcome of a forced one; one that may have resumed the cached session does not count.
+        generation = self._authGeneration
+        with self._authLock:
+            if generation != self._authGeneration and (self._authForced or not force):
+                return self.sessionID is not None
+            result = self._refreshAuth(force)
+            self._authForced = force
+            self._authGeneration = self._authGeneration + 1
+            return result
+
+    def renewSession(self):
+        # Log in again ahead of expiry.  The current token stays in use until the new one is in hand.
+        with self._authLock:
+            self.plugin.debugLog("Renewing Ring session")
+            try:
+                loginResult = self.login(self.plugin.pluginPrefs['UserID'], self.plugin.pluginPrefs['Password'])
+            except requests.exceptions.RequestException as err:
+                self.plugin.debugLog("Ring session renewal failed: %s" % err)
+                return False
+            if loginResult == True:
+                self._saveSession()
+                self._authForced = True
+                self._authGeneration = self._authGeneration + 1
+                return True
+            return False
+
+    def startAuthRefresher(self):
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+        self._refresherStop.clear()
+        self._refresher = threading.Thread(target=self._refreshLoop, name="RingAuthRefresh")
+        self._refresher.daemon = True
+        self._refresher.start()
+
+    def stopAuthRefresher(self):
+        self._refresherStop.set()
+
+    def _refreshLoop(self):
+        while not self._refresherStop.is_set():
+            due = (self._last_auth_refresh or 0) + AUTH_REFRESH_TIMEOUT - AUTH_REFRESH_MARGIN
+            if time.time() < due:
+                self._refresherStop.wait(due - time.time())
+            elif not self.renewSession():
+                self.plugin.errorLog("Failed to renew the Ring session; will try again in %i seconds." % AUTH_RETRY_DELAY)
+                self._refresherStop.wait(AUTH_RETRY_DELAY)
+
+    def _refreshAuth(self, force):
+        # Resume the session cached on disk when there is one; only log in again when there is none,
+        # it has aged past AUTH_REFRESH_TIMEOUT, the API rejects it, or a re-login is forced.
+        if not force:
+            if self.sessionID is None:
+                self._loadSession()
+            if self.sessionID is not None and time.time() - self._last_auth_refresh < AUTH_REFRESH_TIMEOUT:
+                if self._sessionValid():
+                    self.plugin.debugLog("Resumed cached Ring session")
+                    return True
+                self.plugin.debugLog("Cached Ring session was rejected")
+
+        self.sessionID = None
+        loginResult = self.login(self.plugin.pluginPrefs['UserID'], self.plugin.pluginPrefs['Password'])
+        if loginResult == True:
+            self._saveSession()
+            return True
+        self._clearSession()
+        return False
+
+    def _sessionValid(self):
+        # Check the token with a profile request, which also refreshes hasSubscription like GetProfileSettings.
+        # Only an explicit rejection counts; a network error is not a reason to log in again.
+        url = self.baseUrl + 'profile?api_version=8&auth_token=' + self.sessionID
+        try:
+            response = self.transport.get(url, headers=self.headers)
+        except requests.exceptions.RequestException:
+            return True
+        if response.status_code in (401, 403):
+            return False
+        if response.status_code == 200:
+            features = json.loads(response.content)['profile']['features']
+            self.hasSubscription = bool(features['subscriptions_enabled'] or features['ringplus_enabled'])
+        return True
+
+    def _sessionCachePath(self):
+        return os.path.join(indigo.server.getInstallFolderPath(), "Preferences", "Plugins", self.plugin.pluginId + ".session")
+
+    def _loadSession(self):
+        try:
+            with open(self._sessionCachePath()) as f:
+                cached = json.load(f)
+            if cached.get('user') != self.plugin.pluginPrefs.get('UserID'):
+                return
+            self.sessionID = cached['sessionID']
+            self._last_auth_refresh = float(cached['lastAuthRefresh'])
+        except (IOError, OSError):
+            pass
+        except Exception as err:
+            self.plugin.debugLog("Ignoring unreadable Ring session cache: %s" % err)
+
+    def _saveSession(self):
+        # The token is as good as a password, so the cache is readable by this user only.
+        path = self._sessionCachePath()
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            os.fchmod(fd, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'user': self.plugin.pluginPrefs.get('UserID'),
+                           'sessionID': self.sessionID,
+                           'lastAuthRefresh': self._last_auth_refresh}, f)
+        except Exception as err:
+            self.plugin.errorLog("Failed to save the Ring session cache: %s" % err)
+
+    def _clearSession(self):
+        try:
+            os.remove(self._sessionCachePath())
+        except OSError:
+            pass
+
+    def GetDoorbellEventsforIds(self, doorbellIds):
+        # Batched form of GetDoorbellEventsforId: one doorbots/history request for every doorbot id,
+        # split into {doorbot_id: newest Event}.  Ids without a row in the response are left out.
+        doorbellIds = [str(x) for x in doorbellIds]
+        if len(doorbellIds) == 0:
+            return {}
+
+        limit = min(len(doorbellIds) * HISTORY_ROWS_PER_DEVICE, HISTORY_MAX_ROWS)
+        url = self.baseUrl + 'doorbots/history?api_version=9&auth_token=' + self.sessionID
+        url = url + ''.join(['&doorbot_ids%5B%5D=' + x for x in doorbellIds]) + '&limit=' + str(limit)
+        return self._getJson(url, self._decodeLatestHistory, HISTORY)
+
+    def _decodeLatestHistory(self, content):
+        Events = {}
+        for x in content:
+            doorbotId = x['doorbot']['id']
+            if doorbotId in Events:
+                # Rows come back newest first; keep only the latest per doorbot.
+                continue
+            Events[doorbotId] = HistoryEvent(x, self.utc_offset)
+
+        return Events
+
+    def ResolveRecordingUrl(self, recordingId):
+        # Like GetRecordingUrl, but reads the redirect target from the Location header instead of
+        # following it, so no part of the recording itself is downloaded.
+        if self.hasSubscription == False:
+            self.plugin.debugLog('Subscription Disabled')
+            return 'No Subscription'
+
+        url = '%sdings/%s/recording?api_version=8&auth_token=%s' % (self.baseUrl, recordingId, self.sessionID)
+        response = self.transport.get(url, headers={'User-Agent': RECORDING_USER_AGENT}, allow_redirects=False, stream=True, priority=HISTORY)
+        try:
+            if response.status_code in (301, 302, 303, 307, 308):
+                return response.headers['Location']
+            if response.status_code == 200:
+                return url
+            raise Exception("Recording request returned HTTP %s" % response.status_code)
+        finally:
+            response.close()
+
+    # The calls below replace the base client's versions, which open a fresh urllib2/requests
+    # connection per call, with the same requests made over the shared transport.
+
+    def login(self, username, password):
+        self.plugin.debugLog("Logging In")
+        url = self.baseUrl + 'session'
+        postdata = {
+            'device': {
+                'os': 'ios',
+                'hardware_id': str(uuid.uuid1()),
+                'app_brand': 'ring',
+                'metadata': {'api_version': '8', 'language': 'en', 'app_version': '123'},
+            }
+        }
+        response = self.transport.post(url, data=json.dumps(postdata), auth=(username, password), headers=self.headers, priority=COMMAND)
+        if response.status_code != 201:
+            self.plugin.debugLog("Login failed! Check your username/password.")
+            return False
+
+        content = json.loads(response.content)
+        self.sessionID = content['profile']['authentication_token']
+        self._last_auth_refresh = time.time()
+        self.responses.clear()
+        self.shared.clear()
+        self._metadataAt = 0
+        self.GetProfileSettings()
+        return True
+
+    def GetProfileSettings(self):
+        url = self.baseUrl + 'profile?api_version=8&auth_token=' + self.sessionID
+        features = self._cachedGet('profile', url, PROFILE_TTL, lambda content: content['profile']['features'])
+        if features is not None:
+            self.hasSubscription = bool(features['subscriptions_enabled'] or features['ringplus_enabled'])
+
+    def GetDevice(self, doorbellId):
+        url = self.baseUrl + 'ring_devices/' + str(doorbellId) + '?api_version=9&auth_token=' + self.sessionID
+        try:
+            response = self.transport.get(url, headers=self.headers)
+            if response.status_code == 200:
+                content = json.loads(response.content)
+                d = self.Doorbell()
+                d.description = content['description']
+                d.id = content['id']
+                if content['battery_life'] is not None:
+                    d.batterylevel = int(content['battery_life'])
+                d.kind = content['kind']
+                d.firmware_version = content['firmware_version']
+                return d
+        except requests.exceptions.ConnectionError:
+            self.plugin.errorLog(u"Connection was refused.  Could be a network error.")
+            return None
+
+    def GetDevices(self):
+        # Both tiers combined into the base client's Doorbell objects.
+        devices = self._getRingDevices(STATES_TTL)
+        if devices is None:
+            return None
+
+        Devices = {}
+        (metadata, states) = devices
+        for (id, m) in metadata.iteritems():
+            d = self.Doorbell()
+            d.description = m.description
+            d.id = id
+            d.kind = m.kind
+            d.firmware_version = m.firmware_version
+            d.battery_life = states[id].batteryLevel
+            d.batteryLevel = states[id].batteryLevel
+            d.state = states[id].state
+            Devices[id] = d
+        return Devices
+
+    def GetDeviceStates(self):
+        # Live tier, for the poller: battery and light state by device id.
+        devices = self._getRingDevices(STATES_TTL)
+        if devices is None:
+            return None
+        return devices[1]
+
+    def GetDeviceMetadata(self, force=False):
+        # Metadata tier: description, kind and firmware by device id, plus the subscription flags.
+        # Served from memory until METADATA_TTL runs out or a refresh is forced.
+        if force or self._metadataAt + METADATA_TTL <= time.time():
+            if force:
+                # A rescan must not be answered from the coalescer's short-term cache either.
+                self.shared.invalidate('ring_devices')
+            devices = self._getRingDevices(0 if force else DEVICES_TTL)
+            if devices is None:
+                return None
+            self.GetProfileSettings()
+            self.metadata = devices[0]
+            self._metadataAt = time.time()
+        return self.metadata
+
+    def _getRingDevices(self, ttl):
+        url = self.baseUrl + 'ring_devices?api_version=9&auth_token=' + self.sessionID
+        return self._cachedGet('ring_devices', url, ttl, self._decodeDevices)
+
+    def _decodeDevices(self, content):
+        # One ring_devices response split into (metadata, states), each keyed by device id.  The
+        # metadata objects are only replaced when one of their fields actually changed, so callers can
+        # tell an unchanged device by identity.
+        metadata = {}
+        states = {}
+        for group in ('doorbots', 'authorized_doorbots', 'stickup_cams'):
+            for x in content.get(group, []):
+                m = DeviceMetadata(x['id'], x['description'], x['kind'], x['firmware_version'])
+                previous = self.metadata.get(m.id)
+                if previous == m:
+                    m = previous
+                metadata[m.id] = m
+
+                state = None
+                if x.get('led_status') in ('on', 'off'):
+                    state = x['led_status'] == 'on'
+                states[m.id] = DeviceState(x['battery_life'], state)
+        return (metadata, states)
+
+    def _cachedGet(self, key, url, ttl, decode):
+        # GET a JSON endpoint through the response cache and return decode(content), or None if the
+        # request failed.  Served from the cache on a 304, or without a request at all within ttl when
+        # the API sent no validators.
+        value = self.responses.fresh(key, ttl)
+        if value is not None:
+            return value
+        return self.shared.get(key, self._revalidate, key, url, decode)
+
+    def invalidate(self, key):
+        # Forget everything cached for 'ring_devices' or 'profile', so the next call goes to the API.
+        self.responses.invalidate(key)
+        self.shared.invalidate(key)
+
+    def _revalidate(self, key, url, decode):
+        headers = dict(self.headers)
+        headers.update(self.responses.conditionalHeaders(key))
+        response = self.transport.get(url, headers=headers)
+        if response.status_code == 304:
+            return self.responses.notModified(key)
+        if response.status_code != 200:
+            return None
+
+        value = decode(json.loads(response.content))
+        self.responses.store(key, response.headers, value)
+        return value
+
+    def _getJson(self, url, decode, priority=METADATA):
+        # GET a JSON endpoint and return decode(content), or None if the request failed.  Identical
+        # requests made at the same time share one HTTP request and result.
+        return self.shared.get(url, self._fetchJson, url, decode, priority)
+
+    def _fetchJson(self, url, decode, priority):
+        response = self.transport.get(url, headers=self.headers, priority=priority)
+        if response.status_code != 200:
+            return None
+        return decode(json.loads(response.content))
+
+    def GetDoorbellEvent(self):
+        url = self.baseUrl + 'dings/active?api_version=8&auth_token=' + self.sessionID
+        return self._getJson(url, lambda content: dict((x['id'], ActiveDing(x)) for x in content), ACTIVE)
+
+    def GetDoorbellEventsforId(self, doorbellId):
+        url = self.baseUrl + 'doorbots/history?api_version=9&auth_token=' + self.sessionID + '&doorbot_ids%5B%5D=' + str(doorbellId) + '&limit=1'
+        events = self._getJson(url, lambda content: [HistoryEvent(x, self.utc_offset) for x in content[:1]], HISTORY)
+        if events:
+            return events[0]
+        return None
+
+    def GetDoorbellEvents(self):
+        url = self.baseUrl + 'doorbots/history?api_version=8&auth_token=' + self.sessionID + '&limit=30'
+        return self._getJson(url, lambda content: dict((x['id'], HistoryEvent(x, self.utc_offset)) for x in content), HISTORY)
+
+    def GetRecordingUrl(self, recordingId):
+        return self.ResolveRecordingUrl(recordingId)
+
+    def SetSirenOn(self, lightId):
+        return self._deviceCommand(lightId, 'siren_on')
+
+    def SetSirenOff(self, lightId):
+        return self._deviceCommand(lightId, 'siren_off')
+
+    def SetFloodLightOn(self, lightId):
+        return self._deviceCommand(lightId, 'floodlight_light_on')
+
+    def SetFloodLightOff(self, lightId):
+        return self._deviceCommand(lightId, 'floodlight_light_off')
+
+    def _deviceCommand(self, lightId, command):
+        url = self.baseUrl + 'doorbots/' + str(lightId) + '/' + command
+        postdata = {'api_version': '9', 'auth_token': self.sessionID}
+        response = self.transport.put(url, data=json.dumps(postdata), headers=self.headers, priority=COMMAND)
+        return response.status_code == 200
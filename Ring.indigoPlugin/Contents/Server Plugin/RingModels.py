@@ -0,0 +1,102 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Compact read-only models for the data the plugin polls all day.  Device tiers are named tuples;
+# events keep the JSON row they came from and read fields out of it on access, parsing the event
+# time only once and only if something asks for it.
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+DeviceMetadata = namedtuple('DeviceMetadata', 'id description kind firmware_version')
+DeviceState = namedtuple('DeviceState', 'batteryLevel state')
+
+
+class _RowEvent(object):
+    __slots__ = ('_row', '_now')
+
+    # Fields of the Ring client's Event that these rows never carry.
+    recordingUrl = None
+
+    def __init__(self, row):
+        self._row = row
+        self._now = None
+
+    @property
+    def id(self):
+        return self._row['id']
+
+    @property
+    def kind(self):
+        return self._row['kind']
+
+    @property
+    def now(self):
+        if self._now is None:
+            self._now = self._decodeNow()
+        return self._now
+
+
+class ActiveDing(_RowEvent):
+    # A row of dings/active.
+    __slots__ = ()
+
+    answered = False
+    recordingState = 'Not Ready'
+
+    @property
+    def description(self):
+        return self._row['doorbot_description']
+
+    @property
+    def motion(self):
+        return self._row['motion']
+
+    @property
+    def doorbot_id(self):
+        return self._row['doorbot_id']
+
+    @property
+    def state(self):
+        return self._row['state']
+
+    @property
+    def expires_in(self):
+        return self._row['expires_in']
+
+    def _decodeNow(self):
+        return datetime.fromtimestamp(round(self._row['now']))
+
+
+class HistoryEvent(_RowEvent):
+    # A row of doorbots/history.  Its UTC created_at is made local by subtracting utc_offset (seconds
+    # west of UTC, like time.timezone), as the base client does.
+    __slots__ = ('_utcOffset',)
+
+    motion = None
+    state = None
+    expires_in = None
+
+    def __init__(self, row, utcOffset):
+        _RowEvent.__init__(self, row)
+        self._utcOffset = utcOffset
+
+    @property
+    def answered(self):
+        return self._row['answered']
+
+    @property
+    def description(self):
+        return self._row['doorbot']['description']
+
+    @property
+    def doorbot_id(self):
+        return self._row['doorbot']['id']
+
+    @property
+    def recordingState(self):
+        return self._row['recording']['status']
+
+    def _decodeNow(self):
+        utc = datetime.strptime(self._row['created_at'], '%Y-%m-%dT%H:%M:%S.000Z')
+        return utc - timedelta(seconds=self._utcOffset)
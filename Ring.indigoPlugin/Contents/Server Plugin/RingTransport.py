@@ -0,0 +1,115 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Shared HTTP transport for all Ring traffic: one requests.Session with a pool of keep-alive
+# connections, so polls reuse open TLS connections to api.ring.com instead of handshaking every time.
+# Every request is admitted by the RequestDispatcher, by priority lane, within the limits of the
+# connection pool and the shared RateLimiter.
+
+import threading
+
+import requests
+from RateLimiter import RateLimiter, retryAfter
+from RequestDispatcher import RequestDispatcher, COMMAND, METADATA
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 15.0
+
+# A request answered with 429 is retried this many times, after the server's Retry-After, before the
+# 429 is handed back to the caller.
+MAX_THROTTLED_RETRIES = 3
+
+# Commands give up, with requests.exceptions.Timeout, after waiting this long to be sent (for example
+# while Ring has paused us with a 429), rather than going out long after the user asked for them.
+COMMAND_WAIT = 10.0
+
+
+class RingTransport(object):
+    def __init__(self, poolSize=DEFAULT_POOL_SIZE, connectTimeout=DEFAULT_CONNECT_TIMEOUT, readTimeout=DEFAULT_READ_TIMEOUT, log=None):
+        self.log = log or (lambda message: None)
+        self._lock = threading.Lock()
+        self.session = None
+        self._users = {}    # session -> requests using it right now
+        self.limiter = RateLimiter()
+        self.dispatcher = RequestDispatcher(self.limiter, poolSize)
+        self.configure(poolSize, connectTimeout, readTimeout)
+
+    def configure(self, poolSize, connectTimeout, readTimeout):
+        # (Re)build the session.  The old one is closed once the requests still using it are done.
+        session = requests.Session()
+        session.verify = False
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(int(poolSize), 1))
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        with self._lock:
+            previous = self.session
+            self.session = session
+            self.poolSize = max(int(poolSize), 1)
+            self.timeout = (float(connectTimeout), float(readTimeout))
+            closeNow = previous is not None and previous not in self._users
+        self.dispatcher.resize(self.poolSize)
+        if closeNow:
+            previous.close()
+
+    def request(self, method, url, priority=METADATA, **kwargs):
+        # 'priority' is one of the RequestDispatcher lanes.
+        kwargs.setdefault('timeout', self.timeout)
+        wait = COMMAND_WAIT if priority == COMMAND else None
+        for attempt in range(MAX_THROTTLED_RETRIES + 1):
+            if not self.dispatcher.acquire(priority, wait):
+                raise requests.exceptions.Timeout("Ring API request not sent within %i seconds; requests are throttled" % wait)
+            session = self._checkout()
+            try:
+                response = session.request(method, url, **kwargs)
+            finally:
+                self._checkin(session)
+                self.dispatcher.release()
+            if response.status_code != 429:
+                self.limiter.succeeded()
+                return response
+            delay = self.limiter.throttled(retryAfter(response.headers.get('Retry-After')))
+            self.log(u"Ring API is rate limiting requests; pausing for %.1f seconds" % delay)
+            if attempt < MAX_THROTTLED_RETRIES:
+                response.close()
+        return response
+
+    def _checkout(self):
+        with self._lock:
+            session = self.session
+            self._users[session] = self._users.get(session, 0) + 1
+            return session
+
+    def _checkin(self, session):
+        # The last request to finish on a session that configure() replaced closes it.
+        with self._lock:
+            self._users[session] = self._users[session] - 1
+            if self._users[session] > 0:
+                return
+            del self._users[session]
+            if session is self.session:
+                return
+        session.close()
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def warmUp(self, url):
+        # Open a connection (DNS, TCP and TLS) ahead of the first real request.  Failures are ignored;
+        # the first real request will simply pay for the handshake instead.
+        try:
+            self.request('HEAD', url).close()
+        except requests.exceptions.RequestException:
+            pass
+
+    def close(self):
+        with self._lock:
+            if self.session is not None:
+                self.session.close()
@@ -0,0 +1,94 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Hashed timer wheel: any number of pending timers served by a single thread.  Timers hash into one
+# of SLOTS buckets by their expiry tick; each tick only looks at one bucket, so scheduling,
+# cancelling and expiring a timer are all O(1) however many are pending.  Timers have a key;
+# scheduling a key again replaces its pending timer.
+
+import threading
+import time
+
+# Wheel resolution in seconds, and the number of buckets in one turn of the wheel.
+TICK = 0.5
+SLOTS = 512
+
+
+class _Timer(object):
+    __slots__ = ('key', 'slot', 'rounds', 'func', 'args')
+
+
+class TimerWheel(object):
+    def __init__(self, log=None, tick=TICK, slots=SLOTS):
+        self.log = log or (lambda message: None)
+        self.tick = tick
+        self._slots = [dict() for x in range(slots)]   # each bucket: key -> _Timer
+        self._timers = {}                               # key -> _Timer, for cancel/replace
+        self._current = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="RingTimers")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def schedule(self, key, delay, func, *args):
+        # Call func(*args) on the wheel's thread after 'delay' seconds, replacing any timer under 'key'.
+        ticks = max(int(round(delay / self.tick)), 1)
+        timer = _Timer()
+        timer.key = key
+        timer.func = func
+        timer.args = args
+        with self._lock:
+            self._cancel(key)
+            timer.slot = (self._current + ticks) % len(self._slots)
+            timer.rounds = (ticks - 1) // len(self._slots)
+            self._slots[timer.slot][key] = timer
+            self._timers[key] = timer
+
+    def cancel(self, key):
+        with self._lock:
+            self._cancel(key)
+
+    def pending(self):
+        with self._lock:
+            return len(self._timers)
+
+    def _cancel(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            del self._slots[timer.slot][key]
+
+    def _run(self):
+        next = time.time() + self.tick
+        while not self._stop.wait(max(next - time.time(), 0)):
+            next = next + self.tick
+            for timer in self._advance():
+                try:
+                    timer.func(*timer.args)
+                except Exception as err:
+                    self.log(u"Timer %s failed: %s" % (timer.key, err))
+
+    def _advance(self):
+        # Move to the next bucket; return its timers that are due this turn of the wheel.
+        due = []
+        with self._lock:
+            self._current = (self._current + 1) % len(self._slots)
+            bucket = self._slots[self._current]
+            for timer in bucket.values():
+                if timer.rounds > 0:
+                    timer.rounds = timer.rounds - 1
+                else:
+                    due.append(timer)
+            for timer in due:
+                del bucket[timer.key]
+                del self._timers[timer.key]
+        return due
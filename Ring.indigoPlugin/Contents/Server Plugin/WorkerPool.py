@@ -0,0 +1,125 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Bounded pool of worker threads.  Jobs submitted under the same key run one at a time in submission
+# order; jobs under different keys run concurrently, up to the size of the pool.
+
+import sys
+import threading
+from collections import deque
+
+
+class Job(object):
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.result = None
+        self.error = None
+        self.exc_info = None
+        self._done = threading.Event()
+
+    def run(self):
+        try:
+            self.result = self.func(*self.args, **self.kwargs)
+        except Exception as err:
+            self.error = err
+            self.exc_info = sys.exc_info()
+        self._done.set()
+
+    def cancel(self):
+        # The job will never run; anyone waiting on it gets None.
+        self._done.set()
+
+    def wait(self, timeout=None):
+        # Returns the job's result, or None if it is still running after 'timeout' seconds or was cancelled.
+        self._done.wait(timeout)
+        return self.result
+
+    def done(self):
+        return self._done.is_set()
+
+
+class WorkerPool(object):
+    def __init__(self, size, name="RingWorker"):
+        self.name = name
+        self._size = max(int(size), 1)
+        self._threads = []
+        self._pending = {}      # key -> deque of Jobs not yet started
+        self._ready = deque()   # keys with pending jobs and no job running
+        self._running = set()   # keys with a job running right now
+        self._cond = threading.Condition()
+        self._stopped = False
+
+    def start(self):
+        with self._cond:
+            self._stopped = False
+            self._grow()
+
+    def stop(self):
+        # Jobs that have not started yet are cancelled, so nothing is left waiting on them.  Jobs
+        # already running finish as usual.
+        with self._cond:
+            self._stopped = True
+            for key in list(self._pending):
+                for job in self._pending[key]:
+                    job.cancel()
+                self._pending[key].clear()
+                if key not in self._running:
+                    del self._pending[key]
+            self._ready.clear()
+            self._cond.notify_all()
+
+    def resize(self, size):
+        with self._cond:
+            self._size = max(int(size), 1)
+            if not self._stopped:
+                self._grow()
+            self._cond.notify_all()
+
+    def submit(self, key, func, *args, **kwargs):
+        # A job submitted to a stopped pool is cancelled straight away.
+        job = Job(func, args, kwargs)
+        with self._cond:
+            if self._stopped:
+                job.cancel()
+                return job
+            if key not in self._pending:
+                self._pending[key] = deque()
+            self._pending[key].append(job)
+            if key not in self._running and len(self._pending[key]) == 1:
+                self._ready.append(key)
+            self._cond.notify()
+        return job
+
+    def _grow(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self._size:
+            t = threading.Thread(target=self._work, name="%s-%d" % (self.name, len(self._threads) + 1))
+            t.daemon = True
+            self._threads.append(t)
+            t.start()
+
+    def _work(self):
+        me = threading.current_thread()
+        while True:
+            with self._cond:
+                while len(self._ready) == 0 and not self._stopped and self._threads.index(me) < self._size:
+                    self._cond.wait()
+                if self._stopped or self._threads.index(me) >= self._size:
+                    self._threads.remove(me)
+                    self._cond.notify_all()
+                    return
+                key = self._ready.popleft()
+                job = self._pending[key].popleft()
+                self._running.add(key)
+
+            job.run()
+
+            with self._cond:
+                self._running.discard(key)
+                if len(self._pending[key]) > 0:
+                    self._ready.append(key)
+                    self._cond.notify()
+                else:
+                    del self._pending[key]
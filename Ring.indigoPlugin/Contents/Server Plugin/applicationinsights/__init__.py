@@ -1,4 +1,7 @@
-from .TelemetryClient import TelemetryClient
-from . import channel
-from . import logging
-from . import requests
\ No newline at end of file
+# The client and the subpackages are loaded on first use rather than on import, so a host that never
+# starts telemetry never loads the channel and its contract modules.  Import a subpackage (e.g.
+# "import applicationinsights.channel") before using it as an attribute.
+def TelemetryClient(*args, **kwargs):
+    from .TelemetryClient import TelemetryClient as client
+    globals()['TelemetryClient'] = client
+    return client(*args, **kwargs)
@@ -1,7 +1,7 @@
 import collections
 
 from django.conf import settings
-import applicationinsights
+import applicationinsights.channel
 
 ApplicationInsightsSettings = collections.namedtuple("ApplicationInsightsSettings", [
     "ikey",
@@ -1,6 +1,6 @@
 import datetime
 import re
-import applicationinsights
+import applicationinsights.channel
 
 class WSGIApplication(object):
     """ This class represents a WSGI wrapper that enables request telemetry for existing WSGI applications. The request
@@ -3,19 +3,67 @@
 ####################
 
 import sys
+import threading
 import time
-from copy import deepcopy
 from datetime import datetime
 
-import indigo
-from Ring import Ring
-from ghpu import GitHubPluginUpdater
-
-# Need json support; Use "simplejson" for Indigo support
-try:
-    import simplejson as json
-except:
-    import json
+from ImportTimer import ImportTimer
+from LazyModule import lazyImport, loaded
+
+# Modules the Ring client imports up front but only needs at login; they load on first use, on the
+# login thread rather than during plugin start.  requests (and urllib2 with it) cannot be deferred:
+# the compiled Ring class calls requests.packages.urllib3.disable_warnings() as it is defined.
+# Telemetry loads its client only when sendTelemetry is on (see applicationinsights/__init__.py).
+LAZY_MODULES = ("uuid",)
+
+# The plugin's imports are timed so their cost can be logged from the plugin menu.  EventListener
+# is left out on purpose: it is only imported once the listener is enabled.
+with ImportTimer() as importTimes:
+    lazyImport(*LAZY_MODULES)
+    import indigo
+    from CircuitBreaker import CircuitBreaker
+    from CommandQueue import CommandQueue
+    from DeviceRegistry import DeviceRegistry
+    from PollScheduler import PollScheduler
+    from RecordingResolver import RecordingResolver
+    from Ring import Ring
+    from RingClient import RingClient
+    from TimerWheel import TimerWheel
+    from WorkerPool import WorkerPool
+    from ghpu import GitHubPluginUpdater
+
+    # Need json support; Use "simplejson" for Indigo support
+    try:
+        import simplejson as json
+    except:
+        import json
+
+# Default floor and ceiling (seconds) of the adaptive poll interval for each device type.
+DEFAULT_POLL_INTERVALS = {
+    "RingDoorbell": (2, 10),
+    "RingFloodLight": (2, 30),
+    "RingStickupCam": (2, 30),
+}
+
+# Devices due within this many seconds of each other share one poll cycle.
+POLL_COALESCE_WINDOW = 1.0
+
+# Longest a poll cycle waits for its device refreshes; one still running after that is left to finish
+# on its own and the cycle moves on.
+POLL_JOB_TIMEOUT = 60.0
+
+# Longest a pushed notification waits for its devices to be updated before the sender is asked to
+# try again.
+PUSH_APPLY_TIMEOUT = 10.0
+
+# Longest single sleep of the polling thread, so newly started devices are picked up promptly.
+POLL_MAX_SLEEP = 5.0
+
+# Saved watermarks more than this many seconds in the future are discarded on load.
+WATERMARK_CLOCK_SLACK = 300
+
+# How long an active ding or motion counts as active when it does not say (seconds).
+DEFAULT_EVENT_EXPIRY = 180
 
 
 ################################################################################
@@ -23,52 +71,172 @@ class Plugin(indigo.PluginBase):
     ########################################
     def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
         super(Plugin, self).__init__(pluginId, pluginDisplayName, pluginVersion, pluginPrefs)
-        self.Ring = Ring(self)
+        self.Ring = RingClient(self)
         self.debug = pluginPrefs.get("debug", False)
         self.UserID = None
         self.Password = None
         self.deviceList = { }
         self.loginFailed = False
-        self.retryCount = 0
+        # Set once a login has succeeded; devices starting before then wait in pendingDevices.
+        self.ready = threading.Event()
+        self.pendingDevices = set()
+        self._pendingLock = threading.Lock()
+        self._loginLock = threading.Lock()
+        self.breaker = CircuitBreaker(pluginPrefs.get("maxRetry", 5))
         self.keepProcessing = True
         self.restartCount = 0
-
-    def _refreshStatesFromHardware(self, dev):
+        self.scheduler = PollScheduler()
+        self.registry = DeviceRegistry()
+        self.workers = WorkerPool(pluginPrefs.get("refreshWorkers", 4), name="RingRefresh")
+        self.timers = TimerWheel(log=self.errorLog)
+        self.commands = CommandQueue(self._sendCommand, self._commandSent, pluginPrefs.get("commandWorkers", 4))
+        # (device id, target) -> state before the optimistic update, until Ring confirms or rejects it.
+        self.preCommandStates = {}
+        self._preCommandLock = threading.Lock()
+        self.eventListener = None
+        self.lastStates = {}
+        self.lastMetadata = {}
+        self.appliedMetadata = {}
+        self.stateImages = {}
+        self.watermarks = self._loadWatermarks()
+        self.recordedEvents = {}
+        self.recordings = RecordingResolver(self.Ring.ResolveRecordingUrl, self._recordingResolved, log=self.errorLog)
+
+    def _pollCycle(self, devices):
+        # Fetch ring_devices and dings/active once per pass and fan the results out to every device,
+        # so API traffic grows with the number of accounts instead of the number of devices.
+        # Returns the ids of the devices that saw a new event.
+        active = set()
+        states = self._fetch("ring_devices", self.Ring.GetDeviceStates)
+        if states is None:
+            return active
+        self.lastStates = states
+
+        # Metadata only comes from the network every few hours; in between this is a dictionary lookup.
+        metadata = self._fetch("ring_devices", self.Ring.GetDeviceMetadata)
+        if metadata is not None:
+            self.lastMetadata = metadata
+
+        # If dings/active is unavailable, fall back to history so devices still pick up new events.
+        lastEvents = self._fetch("dings/active", self.Ring.GetDoorbellEvent) or {}
+
+        # Route each active ding straight to the devices registered for its doorbot.  Devices
+        # without one sit this cycle out.
+        dings = {}
+        if len(lastEvents) > 0:
+            for event in lastEvents.itervalues():
+                for devId in self.registry.devices(event.doorbot_id):
+                    dings.setdefault(devId, {})[event.id] = event
+            devices = [dev for dev in devices if dev.id in dings]
+
+        # Devices whose circuit is open sit this cycle out too.  This comes last: allow() hands a
+        # half-open circuit its single probe, so every device it lets through must be refreshed.
+        devices = [dev for dev in devices if self.breaker.allow(dev.id)]
+        if len(devices) == 0:
+            return active
+
+        # Nothing active: one batched history request covers every device instead of one each.
+        history = {}
+        if len(lastEvents) == 0:
+            history = self._fetch("doorbots/history", self.Ring.GetDoorbellEventsforIds, [dev.pluginProps["doorbellId"] for dev in devices]) or {}
+
+        # Each device refreshes on the worker pool, so the cycle takes about as long as the slowest device.
+        jobs = [(dev, self.workers.submit(dev.id, self._refreshStatesFromHardware, dev, states, self.lastMetadata, dings.get(dev.id, {}), history)) for dev in devices]
+        deadline = time.time() + POLL_JOB_TIMEOUT
+        for (dev, job) in jobs:
+            if job.wait(max(deadline - time.time(), 0)):
+                active.add(dev.id)
+        return active
+
+    def _fetch(self, endpoint, call, *args):
+        # Call a Ring endpoint through its circuit breaker.  Returns None if the circuit is open or the call failed.
+        if not self.breaker.allow(endpoint):
+            return None
+        try:
+            result = call(*args)
+            if result is None:
+                raise Exception("No data returned from %s" % endpoint)
+        except Exception as err:
+            self._recordFailure(endpoint, "Ring endpoint %s" % endpoint, err)
+            return None
+        self.breaker.success(endpoint)
+        return result
+
+    def _recordFailure(self, key, name, err):
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        Ring.logTrace(self.Ring, "Update Error", { 'Error': str(err), 'Line': str(exc_tb.tb_lineno) })
+
+        self.errorLog("Failed to get correct data for %s. Error: %s, Line:%s" % (name, err, str(exc_tb.tb_lineno)))
+        delay = self.breaker.failure(key)
+        if delay is not None:
+            self.errorLog("%s keeps failing; pausing it for %i seconds. Other devices keep refreshing." % (name, delay))
+
+    def _refreshStatesFromHardware(self, dev, states, metadata, lastEvents, history):
+        # Returns True if the device saw a new event, False if not, or None if the refresh failed.
         try:
             doorbellId = dev.pluginProps["doorbellId"]
             # self.debugLog(u"Getting data for Doorbell : %s" % doorbellId)
-            doorbell = Ring.GetDevice(self.Ring, doorbellId)
-            if doorbell is None:
-                return
-
-            lastEvents = Ring.GetDoorbellEvent(self.Ring)
+            doorbell = states.get(int(doorbellId))
+            if doorbell is None and len(lastEvents) == 0:
+                self.breaker.success(dev.id)
+                return False
 
             if len(lastEvents) == 0:
-                event = Ring.GetDoorbellEventsforId(self.Ring, doorbellId)
+                event = history.get(int(doorbellId))
+                if event is None and dev.states["lastEvent"] == "":
+                    # Crowded out of the batched response and never seen before; ask for this one directly.
+                    event = self.Ring.GetDoorbellEventsforId(doorbellId)
             else:
+                # Only this device's own dings are passed in; the newest one wins.
                 self.debugLog("Recient Event(s) found!  Count: %s" % len(lastEvents))
-                for k, v in lastEvents.iteritems():
-                    event = v
-                    break
+                event = max(lastEvents.itervalues(), key=lambda e: e.now)
 
-            if (event == None):
-                # self.debugLog("Failed to get correct event data for deviceID:%s.  Will keep retrying for now.  " % doorbellId)
-                return
+            # Every changed state is collected here and sent to the server in one batch at the end.
+            changes = []
 
-            isNewEvent = True
+            # Reconcile the light with what Ring reports, unless a command for it has not settled yet.
+            if doorbell is not None and doorbell.state is not None and "onOffState" in dev.states and not self.commands.pending(dev.id, "light"):
+                try:
+                    self.queueState(changes, dev, "onOffState", doorbell.state)
+                except:
+                    self.de(dev, "onOffState")
 
-            if (dev.states["lastEventTime"] != ""):
+            if (event == None):
+                # self.debugLog("Failed to get correct event data for deviceID:%s.  Will keep retrying for now.  " % doorbellId)
+                self.commitStates(dev, changes)
+                self.breaker.success(dev.id)
+                return False
+
+            # Compare against the device's in-memory watermark (last event id and epoch seconds)
+            # rather than re-parsing the lastEventTime state every cycle.
+            eventTime = int(time.mktime(event.now.timetuple()))
+            watermark = self.watermarks.get(dev.id)
+            isNewEvent = watermark is None or eventTime > watermark[1] or (eventTime == watermark[1] and watermark[0] not in (None, event.id))
+            isCurrentEvent = isNewEvent or (watermark is not None and watermark[0] == event.id)
+
+            # Metadata states are only compared when the client hands over a changed metadata object.
+            info = metadata.get(int(doorbellId))
+            if info is not None and self.appliedMetadata.get(dev.id) is not info:
                 try:
-                    isNewEvent = datetime.strptime(dev.states["lastEventTime"], '%Y-%m-%d %H:%M:%S') < event.now
+                    self.queueState(changes, dev, "name", info.description)
                 except:
-                    self.errorLog("Failed to parse some datetimes. If this happens a lot you might need help from the developer!")
+                    self.de(dev, "name")
+                try:
+                    self.queueState(changes, dev, "firmware", info.firmware_version)
+                except:
+                    self.de(dev, "firmware")
+                try:
+                    self.queueState(changes, dev, "model", info.kind)
+                except:
+                    self.de(dev, "model")
 
             # Always update the battery level.  In the event we dont have motion but the battery level
-            if hasattr(doorbell, 'batterylevel') and doorbell.batterylevel is not None:
+            # A pushed event can arrive before the first poll, with no ring_devices state to go on yet.
+            if doorbell is not None and doorbell.batteryLevel is not None:
                 try:
-                    bl = int(doorbell.batterylevel)
+                    bl = int(doorbell.batteryLevel)
                     self.logger.debug(u"Received battery level: %s" % bl)
-                    self.updateStateOnServer(dev, "batteryLevel", bl)
+                    self.queueState(changes, dev, "batteryLevel", bl)
                     error_state = None
                     status_icon = None
                     if bl < 10:
@@ -90,7 +258,10 @@ class Plugin(indigo.PluginBase):
                         # status_icon = indigo.kStateImageSel.BatteryLevelHigh
                         status_icon = indigo.kStateImageSel.SensorOn
                         # dev.updateStateImageOnServer(indigo.kStateImageSel.BatteryLevelHigh)
-                    if error_state is None:
+                    if self.stateImages.get(dev.id) == (status_icon, error_state):
+                        # Icon and error state are already current; skip the server round-trips.
+                        pass
+                    elif error_state is None:
                         self.logger.debug(u'Setting status icon for "%s" to %s' % (dev.name, status_icon))
                         dev.updateStateImageOnServer(status_icon)
                         dev.setErrorStateOnServer(None)
@@ -98,6 +269,7 @@ class Plugin(indigo.PluginBase):
                         self.logger.debug(u'Error with battery level: "%s"' % error_state)
                         dev.updateStateImageOnServer(indigo.kStateImageSel.Error)
                         dev.setErrorStateOnServer(error_state)
+                    self.stateImages[dev.id] = (status_icon, error_state)
                 except:
                     # should handle the exception here, but we're just going to eat it for now
                     self.de(dev, "batteryLevel")
@@ -106,63 +278,150 @@ class Plugin(indigo.PluginBase):
 
             if isNewEvent:
                 try:
-                    self.updateStateOnServer(dev, "name", doorbell.description)
-                except:
-                    self.de(dev, "name")
-                try:
-                    self.updateStateOnServer(dev, "lastEvent", event.kind)
+                    self.queueState(changes, dev, "lastEvent", event.kind)
                 except:
                     self.de(dev, "lastEvent")
+                if len(lastEvents) > 0:
+                    # An active ding: flag it until it expires.
+                    try:
+                        self.queueState(changes, dev, "eventActive", True)
+                        self.timers.schedule((dev.id, "event"), event.expires_in or DEFAULT_EVENT_EXPIRY, self._eventExpired, dev.id)
+                    except:
+                        self.de(dev, "eventActive")
                 try:
-                    self.updateStateOnServer(dev, "lastEventTime", str(event.now))
+                    self.queueState(changes, dev, "lastEventTime", str(event.now))
                 except:
                     self.de(dev, "lastEventTime")
                 try:
-                    self.updateStateOnServer(dev, "lastAnswered", event.answered)
+                    self.queueState(changes, dev, "lastAnswered", event.answered)
                 except:
                     self.de(dev, "lastAnswered")
-                try:
-                    self.updateStateOnServer(dev, "firmware", doorbell.firmware_version)
-                except:
-                    self.de(dev, "firmware")
-                try:
-                    self.updateStateOnServer(dev, "model", doorbell.kind)
-                except:
-                    self.de(dev, "model")
-                if (doorbell.state is not None):
-                    try:
-                        dev.updateStateOnServer("onOffState", doorbell.state)
-                    except:
-                        self.de(dev, "onOffState")
-                if (event.recordingState == "ready"):
-                    try:
-                        self.updateStateOnServer(dev, "recordingUrl", self.Ring.GetRecordingUrl(event.id))
-                    except:
-                        self.de(dev, "recordingUrl")
                 if (event.kind == "motion"):
                     try:
-                        self.updateStateOnServer(dev, "lastMotionTime", str(event.now))
+                        self.queueState(changes, dev, "lastMotionTime", str(event.now))
                     except:
                         self.de(dev, "lastMotionTime")
                 else:
                     try:
-                        self.updateStateOnServer(dev, "lastButtonPressTime", str(event.now))
+                        self.queueState(changes, dev, "lastButtonPressTime", str(event.now))
                     except:
                         self.de(dev, "lastButtonPressTime")
-            self.retryCount = 0
+
+            # The recording usually becomes ready a little after the event itself.  Resolve it off the
+            # polling path; a cached URL is published now, otherwise _recordingResolved does it later.
+            if isCurrentEvent and event.recordingState == "ready" and self.recordedEvents.get(dev.id) != event.id:
+                try:
+                    recordingUrl = self.recordings.request(dev.id, event.id)
+                    if recordingUrl is not None:
+                        self.queueState(changes, dev, "recordingUrl", recordingUrl)
+                        self.recordedEvents[dev.id] = event.id
+                except:
+                    self.de(dev, "recordingUrl")
+
+            self.commitStates(dev, changes)
+            if info is not None:
+                self.appliedMetadata[dev.id] = info
+            if isNewEvent:
+                self.watermarks[dev.id] = (event.id, eventTime)
+            self.breaker.success(dev.id)
+            return isNewEvent
         except Exception as err:
-            self.retryCount = self.retryCount + 1
-            exc_type, exc_obj, exc_tb = sys.exc_info()
-            Ring.logTrace(self.Ring, "Update Error", { 'Error': str(err), 'Line': str(exc_tb.tb_lineno) })
+            self._recordFailure(dev.id, "device %s" % dev.name, err)
+            return None
+
+    def _eventExpired(self, devId):
+        # Called on the timer thread once an active ding's expires_in has passed.
+        if devId in indigo.devices:
+            indigo.devices[devId].updateStateOnServer("eventActive", False)
+
+    def _recordingResolved(self, devId, recordingId, recordingUrl):
+        # Called on the resolver's thread.  Skip it if the device has moved on to a newer event meanwhile.
+        watermark = self.watermarks.get(devId)
+        if devId not in indigo.devices or watermark is None or watermark[0] != recordingId:
+            return
+        dev = indigo.devices[devId]
+        changes = []
+        self.queueState(changes, dev, "recordingUrl", recordingUrl)
+        self.commitStates(dev, changes)
+        self.recordedEvents[devId] = recordingId
+
+    def _eventReceived(self, doorbotId, kind, notification):
+        # Called on the listener's thread for every pushed ding/motion notification.  Returns True once
+        # the event is applied, False if no device has this doorbot, or None if it could not be applied
+        # now and should be sent again.
+        from EventListener import eventTime
+        if not self.ready.is_set():
+            return None
+        devices = [indigo.devices[devId] for devId in self.registry.devices(doorbotId) if devId in indigo.devices]
+        if len(devices) == 0:
+            return False
+
+        event = self.Ring.Event()
+        event.id = notification.get("id", int(time.time() * 1000))
+        event.kind = kind
+        event.motion = kind == "motion"
+        event.doorbot_id = doorbotId
+        event.description = notification.get("doorbot_description")
+        event.state = "ringing"
+        event.expires_in = notification.get("expires_in")
+        event.answered = False
+        event.now = eventTime(notification)
+
+        self.debugLog("Pushed %s event received for doorbot %s" % (kind, doorbotId))
+        jobs = [self.workers.submit(dev.id, self._refreshStatesFromHardware, dev, self.lastStates, self.lastMetadata, {event.id: event}, {}) for dev in devices]
+        for dev in devices:
+            self.scheduler.reschedule(dev.id, True)
+        deadline = time.time() + PUSH_APPLY_TIMEOUT
+        applied = True
+        for job in jobs:
+            if job.wait(max(deadline - time.time(), 0)) is None:
+                applied = False
+        return True if applied else None
+
+    def _startEventListener(self):
+        if self.eventListener is not None:
+            self.eventListener.stop()
+            self.eventListener = None
+
+        if not self.pluginPrefs.get("enableEventListener", False):
+            return
 
-            self.errorLog(
-                "Failed to get correct event data for deviceID:%s. Will keep retrying until max attempts (%s) reached" % (doorbellId, self.pluginPrefs.get("maxRetry", 5)))
-            self.errorLog("Error: %s, Line:%s" % (err, str(exc_tb.tb_lineno)))
+        try:
+            from EventListener import EventListener
+            self.eventListener = EventListener(self.pluginPrefs.get("eventListenerPort", 8177), self._eventReceived,
+                                               address=self.pluginPrefs.get("eventListenerAddress", "127.0.0.1"),
+                                               token=self.pluginPrefs.get("eventListenerToken", ""),
+                                               log=self.debugLog)
+            self.eventListener.start()
+            indigo.server.log(u"Listening for pushed Ring events on %s:%s" % (self.eventListener.address, self.eventListener.port))
+        except Exception as err:
+            self.eventListener = None
+            self.errorLog(u"Failed to start the Ring event listener: %s" % err)
 
-    def updateStateOnServer(self, dev, state, value):
+    def _loadWatermarks(self):
+        try:
+            watermarks = dict((int(k), tuple(v)) for (k, v) in json.loads(self.pluginPrefs.get("eventWatermarks", "{}")).iteritems())
+            # A watermark in the future (saved while history times were shifted the wrong way) would
+            # hide every new event until the clock caught up, so it is dropped.
+            limit = time.time() + WATERMARK_CLOCK_SLACK
+            return dict((k, v) for (k, v) in watermarks.iteritems() if v[1] <= limit)
+        except:
+            self.errorLog("Failed to load saved event watermarks; events will be re-checked against device states.")
+            return {}
+
+    def _saveWatermarks(self):
+        self.pluginPrefs["eventWatermarks"] = json.dumps(dict((str(k), list(v)) for (k, v) in self.watermarks.items() if k in indigo.devices))
+
+    def queueState(self, changes, dev, state, value):
+        # Collect a state change for commitStates, skipping values the device already has.
         if dev.states[state] != value:
             self.debugLog(u"Updating Device: %s, State: %s, Value: %s" % (dev.name, state, value))
-            dev.updateStateOnServer(state, value)
+            changes.append({'key': state, 'value': value})
+
+    def commitStates(self, dev, changes):
+        # One updateStatesOnServer round-trip (and one trigger evaluation) per device per cycle.
+        if len(changes) > 0:
+            dev.updateStatesOnServer(changes)
 
     def de(self, dev, value):
         x = 1
@@ -172,26 +431,80 @@ class Plugin(indigo.PluginBase):
     def startup(self):
         self.debug = self.pluginPrefs.get('showDebugInLog', False)
         self.debugLog(u"startup called")
+        self.debugLog(u"Plugin modules imported in %i ms" % (importTimes.total() * 1000))
 
         self.updater = GitHubPluginUpdater(self)
         # self.updater.checkForUpdate()
         self.updateFrequency = float(self.pluginPrefs.get('updateFrequency', 24)) * 60.0 * 60.0
         self.debugLog(u"updateFrequency = " + str(self.updateFrequency))
         self.next_update_check = time.time()
-        self.login(False)
+        self._configureTransport()
+        self.workers.start()
+        self.commands.start()
+        self.timers.start()
+        self.recordings.start()
+        self._startEventListener()
+        self._startLogin(False)
+
+    def _configureTransport(self):
+        try:
+            self.Ring.transport.configure(self.pluginPrefs.get("httpPoolSize", 4),
+                                          self.pluginPrefs.get("httpConnectTimeout", 5),
+                                          self.pluginPrefs.get("httpReadTimeout", 15))
+            self.Ring.shared.ttl = float(self.pluginPrefs.get("responseCacheTtl", 1.5))
+            self.Ring.transport.limiter.configure(self.pluginPrefs.get("apiRateLimit", 5))
+        except Exception as err:
+            self.errorLog(u"Invalid HTTP connection settings, using defaults: %s" % err)
+
+    def _startLogin(self, force):
+        # Log in and discover devices on a background thread, so startup and the config dialog return at once.
+        thread = threading.Thread(target=self._loginTask, args=(force,), name="RingLogin")
+        thread.daemon = True
+        thread.start()
+
+    def _loginTask(self, force):
+        with self._loginLock:
+            try:
+                self.login(force)
+            except Exception as err:
+                self.loginFailed = True
+                self.errorLog(u"Login to Ring site failed: %s" % err)
 
     def login(self, force):
         if self.Ring.startup(force) == False:
             indigo.server.log(u"Login to Ring site failed.  Canceling processing!", isError=True)
             self.loginFailed = True
+            self.ready.clear()
             return
         else:
             self.loginFailed = False
+            # Keep the session renewed in the background so polls and actions never wait on a login.
+            self.Ring.startAuthRefresher()
 
-            self.buildAvailableDeviceList()
+            try:
+                self.buildAvailableDeviceList()
+            except Exception as err:
+                self.errorLog(u"Device discovery failed: %s" % err)
+
+            # Start the devices that came up while the login was still running.
+            with self._pendingLock:
+                self.ready.set()
+                pending = self.pendingDevices
+                self.pendingDevices = set()
+            for devId in pending:
+                if devId in indigo.devices:
+                    self._startDevice(indigo.devices[devId])
 
     def shutdown(self):
         self.keepProcessing = False
+        self.workers.stop()
+        self.commands.stop()
+        self.timers.stop()
+        self.recordings.stop()
+        self.Ring.stopAuthRefresher()
+        self._saveWatermarks()
+        if self.eventListener is not None:
+            self.eventListener.stop()
         self.debugLog(u"shutdown called")
 
     ########################################
@@ -203,16 +516,14 @@ class Plugin(indigo.PluginBase):
                         self.next_update_check = time.time() + self.updateFrequency
                         self.updater.checkForUpdate()
 
-                    for dev in indigo.devices.iter("self"):
-                        if not dev.enabled:
-                            continue
-                        if (int(self.pluginPrefs.get("maxRetry", 5)) != 0 and self.retryCount >= int(self.pluginPrefs.get("maxRetry", 5))):
-                            self.errorLog("Reached max retry attempts.  Won't Refresh from Server. !")
-                            self.errorLog("You may need to contact Mike for support.  Please post a message at http://forums.indigodomo.com/viewforum.php?f=235")
-                            self.sleep(36000)
-
-                        self._refreshStatesFromHardware(dev)
-                        self.restartCount = self.restartCount + 1
+                    due = self.scheduler.due(time.time() + POLL_COALESCE_WINDOW)
+                    devices = [indigo.devices[devId] for devId in due if devId in indigo.devices and indigo.devices[devId].enabled]
+                    active = set()
+                    if len(devices) > 0:
+                        active = self._pollCycle(devices)
+                        self.restartCount = self.restartCount + len(devices)
+                    for devId in due:
+                        self.scheduler.reschedule(devId, devId in active)
 
                 if (self.restartCount > 10000):
                     self.restartCount = 0
@@ -220,7 +531,9 @@ class Plugin(indigo.PluginBase):
                     serverPlugin = indigo.server.getPlugin(self.pluginId)
                     serverPlugin.restart(waitUntilDone=False)
                     break
-                self.sleep(5)
+
+                wait = self.scheduler.secondsUntilNext()
+                self.sleep(POLL_MAX_SLEEP if wait is None else min(max(wait, 0.1), POLL_MAX_SLEEP))
         except self.StopThread:
             pass  # Optionally catch the StopThread exception and do any needed cleanup.
 
@@ -239,6 +552,40 @@ class Plugin(indigo.PluginBase):
                 int(valuesDict[u"maxRetry"])
             except:
                 errorsDict[u"maxRetry"] = u"Please enter a valid Retry Value."
+        for key in (u"refreshWorkers", u"commandWorkers"):
+            try:
+                if int(valuesDict[key]) < 1:
+                    errorsDict[key] = u"Please enter at least one worker."
+            except:
+                errorsDict[key] = u"Please enter a valid number of workers."
+        try:
+            if float(valuesDict[u"responseCacheTtl"]) < 0:
+                errorsDict[u"responseCacheTtl"] = u"Please enter zero or more seconds."
+        except:
+            errorsDict[u"responseCacheTtl"] = u"Please enter a valid number."
+        for key in (u"httpPoolSize", u"httpConnectTimeout", u"httpReadTimeout", u"apiRateLimit"):
+            try:
+                if float(valuesDict[key]) <= 0:
+                    errorsDict[key] = u"Please enter a value above zero."
+            except:
+                errorsDict[key] = u"Please enter a valid number."
+        if valuesDict.get(u"enableEventListener", False):
+            try:
+                int(valuesDict[u"eventListenerPort"])
+            except:
+                errorsDict[u"eventListenerPort"] = u"Please enter a valid port number."
+            try:
+                float(valuesDict[u"eventListenerReconcileInterval"])
+            except:
+                errorsDict[u"eventListenerReconcileInterval"] = u"Please enter a valid interval in seconds."
+        for typeId in DEFAULT_POLL_INTERVALS:
+            try:
+                floor = float(valuesDict[typeId + u"MinInterval"])
+                ceiling = float(valuesDict[typeId + u"MaxInterval"])
+                if floor <= 0 or ceiling < floor:
+                    errorsDict[typeId + u"MaxInterval"] = u"The maximum must be at least the minimum, and both above zero."
+            except:
+                errorsDict[typeId + u"MinInterval"] = u"Please enter valid poll intervals in seconds."
         if len(errorsDict) > 0:
             self.errorLog(u"\t Validation Errors")
             return (False, valuesDict, errorsDict)
@@ -249,16 +596,46 @@ class Plugin(indigo.PluginBase):
 
     ########################################
     def deviceStartComm(self, dev):
-        if self.loginFailed == True:
-            return
+        try:
+            self.registry.add(dev.pluginProps["doorbellId"], dev.id)
+        except (KeyError, ValueError):
+            self.errorLog(u"%s has no Ring device selected" % dev.name)
+
+        with self._pendingLock:
+            if not self.ready.is_set():
+                self.debugLog(u"Waiting for login before starting %s" % dev.name)
+                self.pendingDevices.add(dev.id)
+                return
+        self._startDevice(dev)
 
+    def _startDevice(self, dev):
         self.initDevice(dev)
 
         dev.stateListOrDisplayStateIdChanged()
 
+        floor, ceiling = self.pollIntervals(dev.deviceTypeId)
+        self.scheduler.add(dev.id, floor, ceiling)
+
     def deviceStopComm(self, dev):
         # Called when communication with the hardware should be shutdown.
-        pass
+        with self._pendingLock:
+            self.pendingDevices.discard(dev.id)
+        self.registry.remove(dev.id)
+        self.scheduler.remove(dev.id)
+        self.stateImages.pop(dev.id, None)
+        self.appliedMetadata.pop(dev.id, None)
+
+    def pollIntervals(self, typeId):
+        floor, ceiling = DEFAULT_POLL_INTERVALS.get(typeId, (5, 5))
+        try:
+            floor = float(self.pluginPrefs.get(typeId + "MinInterval", floor))
+            ceiling = float(self.pluginPrefs.get(typeId + "MaxInterval", ceiling))
+            if self.pluginPrefs.get("enableEventListener", False):
+                # Pushed events cover the latency; polling only has to reconcile now and then.
+                ceiling = max(ceiling, float(self.pluginPrefs.get("eventListenerReconcileInterval", 120)))
+        except:
+            self.errorLog("Invalid poll interval settings for %s, using defaults." % typeId)
+        return (floor, max(floor, ceiling))
 
     def closedPrefsConfigUi(self, valuesDict, userCancelled):
         if not userCancelled:
@@ -277,8 +654,17 @@ class Plugin(indigo.PluginBase):
             except:
                 pass
 
+            self.workers.resize(self.pluginPrefs.get("refreshWorkers", 4))
+            self.commands.resize(self.pluginPrefs.get("commandWorkers", 4))
+            self._configureTransport()
+            self.breaker.maxFailures = int(self.pluginPrefs.get("maxRetry", 5))
+            self._startEventListener()
+            for dev in indigo.devices.iter("self"):
+                floor, ceiling = self.pollIntervals(dev.deviceTypeId)
+                self.scheduler.setLimits(dev.id, floor, ceiling)
+
             indigo.server.log("[%s] Processed plugin preferences." % time.asctime())
-            self.login(True)
+            self._startLogin(True)
             return True
 
     def validateDeviceConfigUi(self, valuesDict, typeId, devId):
@@ -288,13 +674,23 @@ class Plugin(indigo.PluginBase):
 
     def initDevice(self, dev):
         self.debugLog("Initializing Ring device: %s" % dev.name)
-        # if (dev.states["lastEventTime"] == "")
-        dev.states["lastEventTime"] = str(datetime.strptime('2016-01-01 01:00:00', '%Y-%m-%d %H:%M:%S'))
+        if dev.states.get("eventActive", False):
+            # Left over from before a restart; its expiry timer is gone.
+            dev.updateStateOnServer("eventActive", False)
+        if dev.id not in self.watermarks and dev.states["lastEventTime"] != "":
+            # No saved watermark (first run after upgrade): seed it from the last event already shown,
+            # so history the device has seen is not treated as new.
+            try:
+                lastEventTime = datetime.strptime(dev.states["lastEventTime"], '%Y-%m-%d %H:%M:%S')
+                self.watermarks[dev.id] = (None, int(time.mktime(lastEventTime.timetuple())))
+            except:
+                self.errorLog("Failed to parse some datetimes. If this happens a lot you might need help from the developer!")
 
     def buildAvailableDeviceList(self):
         self.debugLog("Building Available Device List")
 
-        self.deviceList = self.Ring.GetDevices()
+        # A rescan always fetches fresh metadata rather than waiting for the metadata TTL.
+        self.deviceList = self.Ring.GetDeviceMetadata(True) or {}
 
         indigo.server.log("Number of devices found: %i" % (len(self.deviceList)))
         for (k, v) in self.deviceList.iteritems():
@@ -307,22 +703,17 @@ class Plugin(indigo.PluginBase):
 
     def doorbellList(self, filter, valuesDict, typeId, targetId):
         self.debugLog("deviceList called")
-        deviceArray = []
-        deviceListCopy = deepcopy(self.deviceList)
-        for existingDevice in indigo.devices.iter("self"):
-            for id in self.deviceList:
-                self.debugLog("States: %s" % existingDevice.address)
-
-                self.debugLog("\tcomparing %s against deviceList item %s" % (existingDevice.address, id))
-                if str(existingDevice.address) == str(id):
-                    self.debugLog("\tremoving item %s" % (id))
-                    del deviceListCopy[id]
-                    break
+        # Everything discovered minus the Ring devices that already have an Indigo device, running or
+        # not; the registry only knows the running ones.
+        configured = set()
+        for dev in indigo.devices.iter("self"):
+            try:
+                configured.add(int(dev.pluginProps.get("doorbellId", dev.address)))
+            except (TypeError, ValueError):
+                pass
+        deviceArray = [(id, value.description) for (id, value) in self.deviceList.iteritems() if id not in configured]
 
-        if len(deviceListCopy) > 0:
-            for (id, value) in deviceListCopy.iteritems():
-                deviceArray.append((id, value.description))
-        else:
+        if len(deviceArray) == 0:
             if len(self.deviceList):
                 indigo.server.log("All devices found are already defined")
             else:
@@ -345,6 +736,20 @@ class Plugin(indigo.PluginBase):
         # self.debugLog(u"\tSelectionChanged valuesDict to be returned:\n%s" % (str(valuesDict)))
         return valuesDict
 
+    def logRequestStats(self):
+        stats = self.Ring.shared.stats()
+        indigo.server.log(u"Ring requests: %(misses)i sent, %(joined)i joined a request in flight, %(hits)i served from the short-term cache (%(cached)i entries)" % stats)
+        limiter = self.Ring.transport.limiter
+        dispatcher = self.Ring.transport.dispatcher
+        indigo.server.log(u"Ring rate limit: %.2f of %.2f requests/second, %i requests deferred, throttled by Ring %i times" % (limiter.rate, limiter.maxRate, dispatcher.deferred, limiter.throttles))
+        indigo.server.log(u"Ring requests by lane: %i commands, %i active dings, %i history, %i metadata" % tuple(dispatcher.served))
+
+    def logImportTimes(self):
+        indigo.server.log(u"Plugin modules imported in %i ms\n%s" % (importTimes.total() * 1000, importTimes.report()))
+        deferred = [name for name in LAZY_MODULES if not loaded(name)]
+        if len(deferred) > 0:
+            indigo.server.log(u"Not loaded yet (deferred until first use): %s" % ", ".join(deferred))
+
     def checkForUpdates(self):
         self.updater.checkForUpdate()
 
@@ -355,114 +760,145 @@ class Plugin(indigo.PluginBase):
         self.updater.update(currentVersion='0.0.0')
 
     def actionControlDevice(self, action, dev):
-        doorbellId = dev.pluginProps["doorbellId"]
         indigo.server.log(u"Current state is \"%s\"" % (dev.onState), isError=False)
         ###### TURN ON ######
         if action.deviceAction == indigo.kDeviceAction.TurnOn:
-            # Command hardware module (dev) to turn ON here:
-            sendSuccess = self.Ring.SetFloodLightOn(str(doorbellId))
-            # sendSuccess = True		# Set to False if it failed.
-
-            if sendSuccess:
-                # If success then log that the command was successfully sent.
-                indigo.server.log(u"sent \"%s\" %s" % (dev.name, "on"))
-
-                # And then tell the Indigo Server to update the state.
-                dev.updateStateOnServer("onOffState", True)
-            else:
-                # Else log failure but do NOT update state on Indigo Server.
-                indigo.server.log(u"send \"%s\" %s failed" % (dev.name, "on"), isError=True)
+            self._queueCommand(dev, "light", True)
 
         ###### TURN OFF ######
         elif action.deviceAction == indigo.kDeviceAction.TurnOff:
-            # Command hardware module (dev) to turn OFF here:
-            sendSuccess = self.Ring.SetFloodLightOff(str(doorbellId))
-
-            if sendSuccess:
-                # If success then log that the command was successfully sent.
-                indigo.server.log(u"sent \"%s\" %s" % (dev.name, "off"))
-
-                # And then tell the Indigo Server to update the state:
-                dev.updateStateOnServer("onOffState", False)
-            else:
-                # Else log failure but do NOT update state on Indigo Server.
-                indigo.server.log(u"send \"%s\" %s failed" % (dev.name, "off"), isError=True)
+            self._queueCommand(dev, "light", False)
 
         ###### TOGGLE ######
         elif action.deviceAction == indigo.kDeviceAction.Toggle:
-            # Command hardware module (dev) to toggle here:
-            indigo.server.log(u"Current state is \"%s\"" % (dev.onState), isError=True)
-            newOnState = not dev.onState
-            sendSuccess = True  # Set to False if it failed.
-
-            if sendSuccess:
-                # If success then log that the command was successfully sent.
-                indigo.server.log(u"sent \"%s\" %s" % (dev.name, "toggle"))
-
-                # And then tell the Indigo Server to update the state:
-                dev.updateStateOnServer("onOffState", newOnState)
-            else:
-                # Else log failure but do NOT update state on Indigo Server.
-                indigo.server.log(u"send \"%s\" %s failed" % (dev.name, "toggle"), isError=True)
+            # dev.onState already reflects any command still queued, so rapid toggles alternate properly.
+            self._queueCommand(dev, "light", not dev.onState)
 
     def _setLightsOn(self, pluginAction):
         self.debugLog(u"\t Set %s - Ligths On" % pluginAction.pluginTypeId)
-        dev = indigo.devices[pluginAction.deviceId]
-        doorbellId = dev.pluginProps["doorbellId"]
+        self._queueCommand(indigo.devices[pluginAction.deviceId], "light", True)
 
-        sendSuccess = self.Ring.SetFloodLightOn(str(doorbellId))
+    def _setLightsOff(self, pluginAction):
+        self.debugLog(u"\t Set %s - Ligths Off" % pluginAction.pluginTypeId)
+        self._queueCommand(indigo.devices[pluginAction.deviceId], "light", False)
 
-        if sendSuccess:
-            # If success then log that the command was successfully sent.
-            indigo.server.log(u"sent \"%s\" %s" % (dev.name, "on"))
+    def _setSirenOn(self, pluginAction):
+        self.debugLog(u"\t Set %s - Siren On" % pluginAction.pluginTypeId)
+        self._queueCommand(indigo.devices[pluginAction.deviceId], "siren", True)
 
-            # And then tell the Indigo Server to update the state:
-            dev.updateStateOnServer("onOffState", True)
-        else:
-            # Else log failure but do NOT update state on Indigo Server.
-            indigo.server.log(u"send \"%s\" %s failed" % (dev.name, "on"), isError=True)
+    def _setSirenOff(self, pluginAction):
+        self.debugLog(u"\t Set %s - Siren Off" % pluginAction.pluginTypeId)
+        self._queueCommand(indigo.devices[pluginAction.deviceId], "siren", False)
 
-    def _setLightsOff(self, pluginAction):
-        self.debugLog(u"\t Set %s - Ligths Off" % pluginAction.pluginTypeId)
-        dev = indigo.devices[pluginAction.deviceId]
-        doorbellId = dev.pluginProps["doorbellId"]
+    def _setLightsOnFor(self, pluginAction):
+        self.debugLog(u"\t Set %s - Lights On for %s seconds" % (pluginAction.pluginTypeId, pluginAction.props.get("duration")))
+        self._queueTimedCommand(indigo.devices[pluginAction.deviceId], "light", float(pluginAction.props.get("duration", 120)))
 
-        sendSuccess = self.Ring.SetFloodLightOff(str(doorbellId))
+    def _setSirenOnFor(self, pluginAction):
+        self.debugLog(u"\t Set %s - Siren On for %s seconds" % (pluginAction.pluginTypeId, pluginAction.props.get("duration")))
+        self._queueTimedCommand(indigo.devices[pluginAction.deviceId], "siren", float(pluginAction.props.get("duration", 120)))
 
-        if sendSuccess:
-            # If success then log that the command was successfully sent.
-            indigo.server.log(u"sent \"%s\" %s" % (dev.name, "off"))
+    def _queueTimedCommand(self, dev, target, seconds):
+        # Turn on now and off again from the timer wheel; any later command for the target cancels the off.
+        self._queueCommand(dev, target, True)
+        self.timers.schedule((dev.id, target), seconds, self._autoOff, dev.id, target)
 
-            # And then tell the Indigo Server to update the state:
-            dev.updateStateOnServer("onOffState", False)
-        else:
-            # Else log failure but do NOT update state on Indigo Server.
-            indigo.server.log(u"send \"%s\" %s failed" % (dev.name, "off"), isError=True)
+    def _autoOff(self, devId, target):
+        if devId in indigo.devices:
+            self._queueCommand(indigo.devices[devId], target, False)
 
-    def _setSirenOn(self, pluginAction):
-        self.debugLog(u"\t Set %s - Siren On" % pluginAction.pluginTypeId)
-        dev = indigo.devices[pluginAction.deviceId]
-        doorbellId = dev.pluginProps["doorbellId"]
+    def _groupLightsOn(self, pluginAction):
+        self._queueGroup(pluginAction, "light", True)
 
-        sendSuccess = self.Ring.SetSirenOn(str(doorbellId))
+    def _groupLightsOff(self, pluginAction):
+        self._queueGroup(pluginAction, "light", False)
 
-        if sendSuccess:
-            # If success then log that the command was successfully sent.
-            indigo.server.log(u"sent Siren \"%s\" %s" % (dev.name, "on"))
-        else:
-            # Else log failure but do NOT update state on Indigo Server.
-            indigo.server.log(u"send Siren \"%s\" %s failed" % (dev.name, "on"), isError=True)
+    def _groupSirenOn(self, pluginAction):
+        self._queueGroup(pluginAction, "siren", True)
 
-    def _setSirenOff(self, pluginAction):
-        self.debugLog(u"\t Set %s - Siren Off" % pluginAction.pluginTypeId)
-        dev = indigo.devices[pluginAction.deviceId]
-        doorbellId = dev.pluginProps["doorbellId"]
+    def _groupSirenOff(self, pluginAction):
+        self._queueGroup(pluginAction, "siren", False)
+
+    def _queueGroup(self, pluginAction, target, on):
+        # Every device gets its own command, so they are sent concurrently (up to commandWorkers at a
+        # time) and each one logs its own success or failure.
+        devices = self._groupDevices(pluginAction.props)
+        self.debugLog(u"\t %s - %i devices" % (pluginAction.pluginTypeId, len(devices)))
+        for dev in devices:
+            self._queueCommand(dev, target, on)
+
+    def _groupDevices(self, props):
+        deviceType = props.get("deviceType", "")
+        if deviceType != "":
+            return [dev for dev in indigo.devices.iter("self") if dev.enabled and dev.deviceTypeId == deviceType]
+        return [indigo.devices[int(devId)] for devId in props.get("devices", []) if int(devId) in indigo.devices]
 
-        sendSuccess = self.Ring.SetSirenOff(str(doorbellId))
+    def validateActionConfigUi(self, valuesDict, typeId, devId):
+        if typeId.endswith("OnFor"):
+            try:
+                if float(valuesDict["duration"]) <= 0:
+                    raise ValueError()
+            except:
+                errorsDict = indigo.Dict()
+                errorsDict["duration"] = u"Please enter a number of seconds above zero."
+                return (False, valuesDict, errorsDict)
+        if typeId.startswith("group") and valuesDict.get("deviceType", "") == "" and len(valuesDict.get("devices", [])) == 0:
+            errorsDict = indigo.Dict()
+            errorsDict["devices"] = u"Please pick a device type or at least one device."
+            return (False, valuesDict, errorsDict)
+        return (True, valuesDict)
 
+    def _queueCommand(self, dev, target, on):
+        # Commands are sent from the command queue so the action returns at once.  The light state is
+        # set optimistically now and reconciled with Ring's report once the command has settled.
+        # If the command fails, the state is put back to what it was before.
+        self.timers.cancel((dev.id, target))
+        if target == "light" and "onOffState" in dev.states:
+            with self._preCommandLock:
+                self.preCommandStates.setdefault((dev.id, target), dev.states["onOffState"])
+                dev.updateStateOnServer("onOffState", on)
+                self.commands.submit(dev.id, target, on)
+        else:
+            self.commands.submit(dev.id, target, on)
+
+    def _sendCommand(self, devId, target, on):
+        # Called on the command queue's threads.
+        dev = indigo.devices[devId]
+        doorbellId = str(dev.pluginProps["doorbellId"])
+        try:
+            if target == "siren":
+                return self.Ring.SetSirenOn(doorbellId) if on else self.Ring.SetSirenOff(doorbellId)
+            return self.Ring.SetFloodLightOn(doorbellId) if on else self.Ring.SetFloodLightOff(doorbellId)
+        except Exception as err:
+            self.errorLog(u"Failed to send command to \"%s\": %s" % (dev.name, err))
+            return False
+
+    def _commandSent(self, devId, target, on, sendSuccess):
+        name = indigo.devices[devId].name if devId in indigo.devices else devId
+        what = u"Siren " if target == "siren" else u""
         if sendSuccess:
             # If success then log that the command was successfully sent.
-            indigo.server.log(u"sent Siren \"%s\" %s" % (dev.name, "off"))
+            indigo.server.log(u"sent %s\"%s\" %s" % (what, name, "on" if on else "off"))
         else:
-            # Else log failure but do NOT update state on Indigo Server.
-            indigo.server.log(u"send Siren \"%s\" %s failed" % (dev.name, "off"), isError=True)
+            # Else log failure and put the optimistic state back.
+            indigo.server.log(u"send %s\"%s\" %s failed" % (what, name, "on" if on else "off"), isError=True)
+        self._settleOptimisticState(devId, target, on, sendSuccess)
+        # ring_devices may be served from cache; make sure the next poll sees the real state.
+        self.Ring.invalidate('ring_devices')
+        self.scheduler.wake(devId)
+
+    def _settleOptimisticState(self, devId, target, on, sendSuccess):
+        # While a newer command is queued the state stays as the user set it; the value to fall back on
+        # becomes whatever Ring last accepted.  Otherwise a failed command restores the earlier state,
+        # since a device that reports no led_status would never correct it.
+        key = (devId, target)
+        with self._preCommandLock:
+            if key not in self.preCommandStates:
+                return
+            if self.commands.queued(devId, target):
+                if sendSuccess:
+                    self.preCommandStates[key] = on
+                return
+            previous = self.preCommandStates.pop(key)
+            if not sendSuccess and devId in indigo.devices:
+                indigo.devices[devId].updateStateOnServer("onOffState", previous)